@@ -0,0 +1,439 @@
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import re
+import time
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Iterable
+
+import typesense.exceptions
+
+logger = logging.getLogger(__name__)
+
+
+TAG_PATTERN = re.compile(r"<[^>]+>|&[#\w]+;")
+TOKEN_PATTERN = re.compile(r"\w+")
+CLAUSE_PATTERN = re.compile(r"^\s*([\w.]+)\s*:\s*(:?=|!=|>=|<=|>|<)?\s*(.*?)\s*$")
+VALUE_PATTERN = re.compile(r"`([^`]*)`|([^,]+)")
+SORT_PATTERN = re.compile(r"^\s*([\w.]+)(?:\(([^)]*)\))?\s*(?::\s*(asc|desc))?\s*$")
+
+TEXT_FIELDS = ("formattedtitle", "title", "text")
+FACET_FIELDS = ("clan", "keywords", "legality", "deck", "type")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(TAG_PATTERN.sub(" ", text).lower())
+
+
+def values_of(document: dict, field: str) -> list[Any]:
+    value = document.get(field)
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def split_filter(filter_by: str) -> list[str]:
+    """Clauses, &&, ||, and parentheses of a filter_by expression
+
+    Backtick-quoted values and [] lists are kept whole.
+    """
+    tokens: list[str] = []
+    clause: list[str] = []
+    quoted = False
+    depth = 0
+    position = 0
+    while position < len(filter_by):
+        char = filter_by[position]
+        pair = filter_by[position : position + 2]
+        if char == "`":
+            quoted = not quoted
+        elif not quoted and char in "[]":
+            depth += 1 if char == "[" else -1
+        elif not quoted and not depth and (pair in {"&&", "||"} or char in "()"):
+            if text := "".join(clause).strip():
+                tokens.append(text)
+            clause = []
+            token = pair if pair in {"&&", "||"} else char
+            tokens.append(token)
+            position += len(token)
+            continue
+        clause.append(char)
+        position += 1
+
+    if text := "".join(clause).strip():
+        tokens.append(text)
+    return tokens
+
+
+def as_number(value: Any) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Index:
+    """In-memory inverted index over the documents of one collection
+
+    Text fields map every token to the set of documents containing it, and
+    facet fields map every value to its set of documents, so a search is a
+    handful of set intersections.
+    """
+
+    def __init__(self, documents: list[dict]) -> None:
+        self.documents = documents
+        self.all = frozenset(range(len(documents)))
+        self.tokens: dict[str, dict[str, set[int]]] = {}
+        self.vocabulary: dict[str, list[str]] = {}
+        self.facets: dict[str, dict[str, set[int]]] = {}
+        self.ranks: dict[str, tuple[list[int], int]] = {}
+
+        for field in TEXT_FIELDS:
+            postings: dict[str, set[int]] = defaultdict(set)
+            for doc_id, document in enumerate(documents):
+                for value in values_of(document, field):
+                    for token in tokenize(str(value)):
+                        postings[token].add(doc_id)
+            self.tokens[field] = dict(postings)
+            self.vocabulary[field] = sorted(postings)
+
+        for field in FACET_FIELDS:
+            self.facet(field)
+
+    def facet(self, field: str) -> dict[str, set[int]]:
+        """Value -> documents, built on first use for non facet fields"""
+        if (facet := self.facets.get(field)) is None:
+            facet = defaultdict(set)
+            for doc_id, document in enumerate(self.documents):
+                for value in values_of(document, field):
+                    facet[str(value)].add(doc_id)
+            facet = self.facets[field] = dict(facet)
+        return facet
+
+    def match_token(self, field: str, token: str, prefix: bool) -> set[int]:
+        postings = self.tokens.get(field, {})
+        if not prefix:
+            return postings.get(token, set())
+
+        matched: set[int] = set()
+        vocabulary = self.vocabulary.get(field, [])
+        for position in range(bisect.bisect_left(vocabulary, token), len(vocabulary)):
+            if not vocabulary[position].startswith(token):
+                break
+            matched |= postings[vocabulary[position]]
+        return matched
+
+    def match(self, q: str, query_by: Iterable[str]) -> frozenset[int] | set[int]:
+        """Documents containing every token of q, the last one as a prefix"""
+        tokens = tokenize(q) if q.strip() != "*" else []
+        if not tokens:
+            return self.all
+
+        fields = [x for x in query_by if x in self.tokens]
+        result: set[int] | None = None
+        for position, token in enumerate(tokens):
+            prefix = position == len(tokens) - 1
+            matched: set[int] = set()
+            for field in fields:
+                matched |= self.match_token(field, token, prefix)
+            result = matched if result is None else result & matched
+            if not result:
+                break
+        return result or set()
+
+    def filter(self, filter_by: str) -> frozenset[int] | set[int]:
+        """Subset of the Typesense filter_by grammar
+
+        Clauses joined by && and ||, && binding tighter, grouped by parentheses.
+        """
+        tokens = split_filter(filter_by)
+        result, position = self.filter_or(tokens, 0)
+        if position != len(tokens):
+            raise typesense.exceptions.RequestMalformed(f"Invalid filter {filter_by}")
+        return result
+
+    def filter_or(
+        self, tokens: list[str], position: int
+    ) -> tuple[frozenset[int] | set[int], int]:
+        result, position = self.filter_and(tokens, position)
+        while position < len(tokens) and tokens[position] == "||":
+            matched, position = self.filter_and(tokens, position + 1)
+            result = result | matched
+        return result, position
+
+    def filter_and(
+        self, tokens: list[str], position: int
+    ) -> tuple[frozenset[int] | set[int], int]:
+        result: frozenset[int] | set[int] = self.all
+        while position < len(tokens) and tokens[position] not in {"||", ")"}:
+            if tokens[position] == "&&":
+                position += 1
+                continue
+            if tokens[position] == "(":
+                matched, position = self.filter_or(tokens, position + 1)
+                if position >= len(tokens) or tokens[position] != ")":
+                    raise typesense.exceptions.RequestMalformed("Unbalanced filter")
+                position += 1
+            else:
+                if not (match := CLAUSE_PATTERN.match(tokens[position])):
+                    raise typesense.exceptions.RequestMalformed(
+                        f"Invalid filter {tokens[position]}"
+                    )
+                field, operator, raw_value = match.groups()
+                matched = self.filter_clause(field, operator or ":", raw_value)
+                position += 1
+            result = result & matched
+        return result, position
+
+    def filter_clause(self, field: str, operator: str, raw_value: str) -> set[int]:
+        if raw_value.startswith("[") and raw_value.endswith("]"):
+            raw_value = raw_value[1:-1]
+        values = [
+            (quoted or plain).strip()
+            for quoted, plain in VALUE_PATTERN.findall(raw_value)
+        ]
+
+        facet = self.facet(field)
+        if operator in {":", "="}:
+            if len(values) == 1 and ".." in values[0]:
+                low, _, high = values[0].partition("..")
+                return self.filter_range(field, float(low), float(high))
+            matched: set[int] = set()
+            for value in values:
+                if operator == "=":
+                    matched |= facet.get(value, set())
+                else:
+                    matched |= self.filter_contains(field, value)
+            return matched
+        if operator == "!=":
+            excluded: set[int] = set()
+            for value in values:
+                excluded |= facet.get(value, set())
+            return set(self.all - excluded)
+
+        number = float(values[0])
+        low, high = {
+            ">": (number, None),
+            ">=": (number, None),
+            "<": (None, number),
+            "<=": (None, number),
+        }[operator]
+        strict = operator in {">", "<"}
+        return self.filter_range(field, low, high, strict)
+
+    def filter_contains(self, field: str, value: str) -> set[int]:
+        """Non-exact match: every token of value, trailing * for a prefix"""
+        prefix = value.endswith("*")
+        tokens = tokenize(value.rstrip("*"))
+        matched: set[int] = set()
+        for facet_value, doc_ids in self.facet(field).items():
+            facet_tokens = tokenize(facet_value)
+            if all(
+                any(
+                    (
+                        x.startswith(token)
+                        if prefix and position == len(tokens) - 1
+                        else x == token
+                    )
+                    for x in facet_tokens
+                )
+                for position, token in enumerate(tokens)
+            ):
+                matched |= doc_ids
+        return matched
+
+    def filter_range(
+        self,
+        field: str,
+        low: float | None,
+        high: float | None,
+        strict: bool = False,
+    ) -> set[int]:
+        matched: set[int] = set()
+        for value, doc_ids in self.facet(field).items():
+            if (number := as_number(value)) is None:
+                continue
+            if low is not None and (number < low or strict and number == low):
+                continue
+            if high is not None and (number > high or strict and number == high):
+                continue
+            matched |= doc_ids
+        return matched
+
+    def rank(self, field: str) -> tuple[list[int], int]:
+        """Position of every document when sorted on field, missing values last
+
+        Also returns how many documents have a value for field.
+        """
+        if (rank := self.ranks.get(field)) is None:
+
+            def key(doc_id: int) -> tuple:
+                values = values_of(self.documents[doc_id], field)
+                if not values:
+                    return (1, 0, "")
+                if (number := as_number(values[0])) is not None:
+                    return (0, number, "")
+                return (0, 0, str(values[0]).lower())
+
+            order = sorted(range(len(self.documents)), key=key)
+            positions = [0] * len(self.documents)
+            for position, doc_id in enumerate(order):
+                positions[doc_id] = position
+            present = sum(1 for x in order if key(x)[0] == 0)
+            rank = self.ranks[field] = (positions, present)
+        return rank
+
+    def sort(self, doc_ids: Iterable[int], sort_by: str) -> list[int]:
+        ordered = sorted(doc_ids)
+        # Stable sorts applied from the least to the most significant field
+        for clause in reversed([x for x in sort_by.split(",") if x.strip()]):
+            if not (match := SORT_PATTERN.match(clause)):
+                raise typesense.exceptions.RequestMalformed(f"Invalid sort {clause}")
+            field, arguments, order = match.groups()
+
+            if field == "_rand":
+                seed = arguments or "0"
+                ordered.sort(key=lambda x: zlib.crc32(f"{seed}:{x}".encode()))
+                continue
+
+            positions, present = self.rank(field)
+            if order == "desc":
+                ordered.sort(key=lambda x: (positions[x] >= present, -positions[x]))
+            else:
+                ordered.sort(key=positions.__getitem__)
+        return ordered
+
+    def search(self, search_query: dict) -> dict:
+        start = time.perf_counter()
+
+        doc_ids = self.match(
+            search_query.get("q", "*"),
+            str(search_query.get("query_by", ",".join(TEXT_FIELDS))).split(","),
+        )
+        if filter_by := search_query.get("filter_by"):
+            doc_ids = doc_ids & self.filter(filter_by)
+
+        ordered = self.sort(doc_ids, search_query.get("sort_by", ""))
+
+        if "limit" in search_query or "offset" in search_query:
+            limit = int(search_query.get("limit", 10))
+            offset = int(search_query.get("offset", 0))
+        else:
+            limit = int(search_query.get("per_page", 10))
+            offset = (int(search_query.get("page", 1)) - 1) * limit
+
+        search_results = {
+            "found": len(ordered),
+            "out_of": len(self.documents),
+            "hits": [
+                {"document": self.documents[x]}
+                for x in ordered[offset : offset + limit]
+            ],
+        }
+        if facet_by := search_query.get("facet_by"):
+            search_results["facet_counts"] = self.facet_counts(
+                doc_ids,
+                facet_by.split(","),
+                int(search_query.get("max_facet_values", 10)),
+            )
+        search_results["search_time_ms"] = int((time.perf_counter() - start) * 1000)
+
+        return search_results
+
+    def facet_counts(
+        self, doc_ids: Iterable[int], fields: list[str], max_facet_values: int
+    ) -> list[dict]:
+        doc_ids = doc_ids if isinstance(doc_ids, (set, frozenset)) else set(doc_ids)
+        facet_counts = []
+        for field in fields:
+            counts = sorted(
+                (
+                    (len(ids & doc_ids), value)
+                    for value, ids in self.facet(field).items()
+                    if not ids.isdisjoint(doc_ids)
+                ),
+                key=lambda x: (-x[0], x[1]),
+            )
+            facet_counts.append(
+                {
+                    "field_name": field,
+                    "counts": [
+                        {"count": count, "value": value}
+                        for count, value in counts[:max_facet_values]
+                    ],
+                }
+            )
+        return facet_counts
+
+
+class EmbeddedEngine:
+    """In-process replacement for TypesenseEngine, no search server needed"""
+
+    def __init__(self, collections: dict[str, list[dict]]) -> None:
+        self.indexes = {name: Index(x) for name, x in collections.items()}
+
+    @classmethod
+    def from_xml(cls, database: Path, collection: str = "l5r") -> EmbeddedEngine:
+        """Convert and index the cards the same way the ingestor does"""
+        from . import ingestor
+
+        ingestor.generate_images = False
+
+        start = time.perf_counter()
+        documents = []
+        attributes: dict[str, set[str]] = defaultdict(set)
+        for card in ingestor.iter_cards(database):
+            if card_dict := ingestor.xml_to_dict(card):
+                documents.append(card_dict)
+                ingestor.update_attributes(attributes, card_dict)
+
+        ranks = ingestor.title_ranks(
+            {x["cardid"]: x["formattedtitle"] for x in documents}
+        )
+        for document in documents:
+            document["content_hash"] = ingestor.card_hash(document)
+            document["title_rank"] = ranks[document["cardid"]]
+
+        engine = cls(
+            {
+                collection: documents,
+                ingestor.ATTRIBUTES_COLLECTION: [
+                    {
+                        "database": collection,
+                        "lookup": lookup,
+                        "payload": json.dumps(payload),
+                    }
+                    for lookup, payload in ingestor.build_attributes(attributes).items()
+                ],
+            }
+        )
+        logger.info(
+            "Indexed %s cards in %.2fs", len(documents), time.perf_counter() - start
+        )
+        return engine
+
+    def index(self, collection: str) -> Index:
+        if (index := self.indexes.get(collection)) is None:
+            raise typesense.exceptions.ObjectNotFound(f"No collection {collection}")
+        return index
+
+    async def search(self, collection: str, search_query: dict) -> dict:
+        return self.index(collection).search(search_query)
+
+    async def multi_search(self, collection: str, searches: list[dict]) -> list[dict]:
+        return [self.index(collection).search(x) for x in searches]
+
+    async def retrieve(self, collection: str) -> dict:
+        return {
+            "name": collection,
+            "num_documents": len(self.index(collection).documents),
+        }
+
+    async def close(self) -> None:
+        pass
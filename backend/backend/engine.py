@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import logging
+from typing import Any
+
+import httpx
+import typesense.exceptions
+
+from .metrics import ENGINE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+ERRORS = {
+    400: typesense.exceptions.RequestMalformed,
+    401: typesense.exceptions.RequestUnauthorized,
+    403: typesense.exceptions.RequestForbidden,
+    404: typesense.exceptions.ObjectNotFound,
+    409: typesense.exceptions.ObjectAlreadyExists,
+    422: typesense.exceptions.ObjectUnprocessable,
+    500: typesense.exceptions.ServerError,
+    503: typesense.exceptions.ServiceUnavailable,
+}
+
+
+class TypesenseEngine:
+    """Async access to Typesense over a pool of keep-alive connections
+
+    The synchronous typesense.Client blocks the event loop for the whole round
+    trip, this one lets concurrent requests overlap their Typesense latency.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 8108,
+        protocol: str = "http",
+        api_key: str = "xyz",
+        pool_size: int = 20,
+        timeout: float = 2.0,
+    ) -> None:
+        self.client = httpx.AsyncClient(
+            base_url=f"{protocol}://{host}:{port}",
+            headers={"X-TYPESENSE-API-KEY": api_key},
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            timeout=httpx.Timeout(timeout),
+        )
+
+    async def request(self, method: str, path: str, **kwargs: Any) -> Any:
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except httpx.TimeoutException as error:
+            ENGINE_ERRORS.inc("Timeout")
+            raise typesense.exceptions.Timeout(str(error)) from error
+        except httpx.TransportError:
+            ENGINE_ERRORS.inc("TransportError")
+            raise
+
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("message", response.text)
+            except ValueError:
+                message = response.text
+            error = ERRORS.get(
+                response.status_code, typesense.exceptions.TypesenseClientError
+            )
+            ENGINE_ERRORS.inc(error.__name__)
+            raise error(message)
+
+        return response.json()
+
+    async def search(self, collection: str, search_query: dict) -> dict:
+        return await self.request(
+            "GET",
+            f"/collections/{collection}/documents/search",
+            params={
+                key: str(value).lower() if isinstance(value, bool) else str(value)
+                for key, value in search_query.items()
+            },
+        )
+
+    async def multi_search(self, collection: str, searches: list[dict]) -> list[dict]:
+        """Several searches in one POST, for parameters too long for a URL"""
+        response = await self.request(
+            "POST",
+            "/multi_search",
+            json={"searches": [{"collection": collection, **x} for x in searches]},
+        )
+        results = response["results"]
+        for result in results:
+            if "error" in result:
+                error = ERRORS.get(
+                    result.get("code"), typesense.exceptions.TypesenseClientError
+                )
+                ENGINE_ERRORS.inc(error.__name__)
+                raise error(result["error"])
+        return results
+
+    async def retrieve(self, collection: str) -> dict:
+        return await self.request("GET", f"/collections/{collection}")
+
+    async def close(self) -> None:
+        await self.client.aclose()
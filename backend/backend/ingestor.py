@@ -1,11 +1,20 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
+import hashlib
+import itertools
+import json
 import logging
+import os
 import re
 import shutil
+import time
+import urllib.request
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 from pathlib import Path
-from typing import TypedDict
+from typing import Any, Iterable, Iterator, NotRequired, TypedDict
 
 import lxml.etree as ET
 import typesense
@@ -18,7 +27,10 @@ from .mappings import (
     LEGALITY_MAPPING,
     RARITY_MAPPING,
     TYPE_MAPPING,
+    group_by_arc,
 )
+from .shards import ShardWriter
+from .snapshot import SnapshotWriter
 
 logger = logging.getLogger(__name__)
 
@@ -37,7 +49,7 @@ def init_client() -> None:
                 }
             ],
             "api_key": "xyz",
-            "connection_timeout_seconds": 2,
+            "connection_timeout_seconds": 10,
         }
     )
 
@@ -84,35 +96,368 @@ OUTPUT_FOLDER = Path(r"E:/L5R/L5R/Oracle/")
 import PIL.Image as Image
 
 
+class Profile:
+    """Wall time and count of every ingest stage, summarized by --profile
+
+    Stages nest: xml_to_dict includes convert_text and the image stages run
+    inline. With an image pipeline, image_encode is the time spent in the
+    worker processes.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.stages: dict[str, list[float]] = defaultdict(lambda: [0, 0.0])
+        self.cards: list[float] = []
+
+    def add(self, name: str, seconds: float, count: int = 1) -> None:
+        stage = self.stages[name]
+        stage[0] += count
+        stage[1] += seconds
+
+    def merge(self, stages: dict[str, list[float]], cards: list[float]) -> None:
+        """Add the timings a conversion worker recorded"""
+        for name, (count, seconds) in stages.items():
+            self.add(name, seconds, int(count))
+        self.cards.extend(cards)
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def summary(self) -> dict[str, Any]:
+        elapsed = time.perf_counter() - self.start
+        cards = sorted(self.cards)
+        return {
+            "wall_time": round(elapsed, 3),
+            "cards": len(cards),
+            "cards_per_second": round(len(cards) / elapsed, 1) if elapsed else 0,
+            "card_latency_ms": {
+                "p50": round(cards[len(cards) // 2] * 1000, 3) if cards else 0,
+                "p95": round(cards[int(len(cards) * 0.95)] * 1000, 3) if cards else 0,
+            },
+            "stages": {
+                name: {"count": count, "wall_time": round(seconds, 3)}
+                for name, (count, seconds) in self.stages.items()
+            },
+        }
+
+    def write(self, path: Path) -> None:
+        summary = self.summary()
+        path.write_text(json.dumps(summary, indent=2))
+        logger.info(
+            "Profile written to %s: %s cards in %ss, %s cards/s",
+            path,
+            summary["cards"],
+            summary["wall_time"],
+            summary["cards_per_second"],
+        )
+
+
+profile: Profile | None = None
+
+
+def profiled(name: str) -> contextlib.AbstractContextManager:
+    """Time a stage when --profile is on"""
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.stage(name)
+
+
+class ImageIndex:
+    """Filename index of the image packs, built with a single directory walk
+
+    Maps each casefolded file stem to the first matching path so lookups
+    don't have to rglob the packs for every printing, and match regardless of
+    case as rglob does on the Windows packs. It can be persisted to disk and
+    is rebuilt when a directory changed.
+    """
+
+    # Bumped when the keys change, older caches are rebuilt
+    FORMAT = 2
+
+    def __init__(self, paths: dict[str, str], mtimes: dict[str, float]) -> None:
+        self.paths = paths
+        self.mtimes = mtimes
+
+    @classmethod
+    def build(cls, root: Path) -> ImageIndex:
+        paths: dict[str, str] = {}
+        mtimes: dict[str, float] = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            mtimes[dirpath] = os.stat(dirpath).st_mtime
+            for filename in sorted(filenames):
+                paths.setdefault(
+                    Path(filename).stem.casefold(), os.path.join(dirpath, filename)
+                )
+
+        logger.info("Indexed %s images from %s", len(paths), root)
+        return cls(paths, mtimes)
+
+    @classmethod
+    def load(cls, root: Path, cache: Path | None = None) -> ImageIndex:
+        if cache is not None and cache.exists():
+            data = json.loads(cache.read_text())
+            index = cls(data["paths"], data["mtimes"])
+            if (
+                data.get("format") == cls.FORMAT
+                and data["root"] == str(root)
+                and index.is_fresh()
+            ):
+                logger.info("Loaded image index from %s", cache)
+                return index
+            logger.info("Image index %s is stale, rebuilding", cache)
+
+        index = cls.build(root)
+        if cache is not None:
+            cache.write_text(
+                json.dumps(
+                    {
+                        "format": cls.FORMAT,
+                        "root": str(root),
+                        "paths": index.paths,
+                        "mtimes": index.mtimes,
+                    }
+                )
+            )
+        return index
+
+    def is_fresh(self) -> bool:
+        """Adding, removing or renaming a file updates its directory mtime"""
+        for directory, mtime in self.mtimes.items():
+            try:
+                if os.stat(directory).st_mtime != mtime:
+                    return False
+            except FileNotFoundError:
+                return False
+        return True
+
+    def find(self, image_name: str) -> Path | None:
+        name = image_name.casefold()
+        path = self.paths.get(name) or self.paths.get(name.replace("_", ""))
+        return Path(path) if path else None
+
+
+image_index: ImageIndex | None = None
+MISSING_IMAGES: list[tuple[str, str]] = []
+
+
+def find_source_image(card_id: str, image_name: str) -> Path | None:
+    global image_index
+    if image_index is None:
+        image_index = ImageIndex.build(IMAGE_FOLDER)
+
+    with profiled("image_lookup"):
+        path = image_index.find(image_name)
+    if not path:
+        logger.debug("Image %s not found", image_name)
+        MISSING_IMAGES.append((card_id, image_name))
+    return path
+
+
+# Derivative -> bounding box, None keeps the size of the source image. The
+# details and select JPEGs keep their historical names for existing clients.
+IMAGE_SIZES: dict[str, tuple[int, int] | None] = {
+    "details": None,
+    "select": (150, 210),
+    "select2x": (300, 420),
+    "master": (750, 1050),
+}
+# Extension -> Pillow format and save options, in order of preference
+IMAGE_FORMATS: dict[str, dict[str, Any]] = {
+    "avif": {"format": "AVIF", "quality": 55, "speed": 6},
+    "webp": {"format": "WEBP", "quality": 80, "method": 6},
+    "jpg": {"format": "JPEG", "quality": 85, "optimize": True, "progressive": True},
+}
+
+image_profiles: dict[str, dict] = {"sizes": IMAGE_SIZES, "formats": IMAGE_FORMATS}
+
+
+def load_image_profiles(path: Path | None = None) -> dict[str, dict]:
+    """Sizes and formats from a JSON file, the defaults for missing keys
+
+    Formats that this Pillow build cannot write are dropped, AVIF needs 11.3.
+    """
+    loaded = json.loads(path.read_text()) if path is not None else {}
+    sizes = {
+        name: tuple(box) if box else None
+        for name, box in loaded.get("sizes", IMAGE_SIZES).items()
+    }
+    Image.init()
+    formats = {}
+    for extension, options in loaded.get("formats", IMAGE_FORMATS).items():
+        if options["format"] not in Image.SAVE:
+            logger.warning("Pillow cannot write %s images, skipped", extension)
+            continue
+        formats[extension] = options
+    return {"sizes": sizes, "formats": formats}
+
+
+def image_manifest_name(card_id: str, index: int) -> str:
+    return f"printing_{card_id}_{index}.json"
+
+
 def get_image_path(
-    card_id: str, image_name: str, edition_acronym_: str, number: str, index: int
+    card_id: str, path: Path, edition_acronym_: str, number: str, index: int
 ) -> None:
+    """Write every size and format of a printing, and the manifest listing them
+
+    The manifest records a hash of the profiles it was generated with, so
+    images are only generated again when the source or the profiles change.
+    """
     output_folder = OUTPUT_FOLDER / edition_acronym_ / number
-    details_path = output_folder / f"printing_{card_id}_{index}_details.jpg"
-    select_path = output_folder / f"printing_{card_id}_{index}_select.jpg"
-
-    if details_path.exists() and select_path.exists():
-        return None
-
-    if not (path := next(IMAGE_FOLDER.rglob(f"{image_name}.*"), None)):
-        if not (
-            path := next(IMAGE_FOLDER.rglob(f"{image_name.replace('_', '')}.*"), None)
-        ):
-            logger.warning("Image %s not found", image_name)
-            breakpoint()
+    manifest_path = output_folder / image_manifest_name(card_id, index)
+    profiles = hashlib.sha1(
+        json.dumps(image_profiles, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    source = {"name": path.name, "mtime": int(path.stat().st_mtime)}
+
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest.get("profiles") == profiles and manifest.get("source") == source:
             return None
 
     output_folder.mkdir(parents=True, exist_ok=True)
 
-    # Convert to JPG
-    image = Image.open(path)
-    if image.mode == "RGBA":
-        image = image.convert("RGB")
-    image.save(details_path)
+    original = Image.open(path)
+    if original.mode not in {"RGB", "L"}:
+        original = original.convert("RGB")
+
+    sizes = {}
+    for name, box in image_profiles["sizes"].items():
+        image = original.copy()
+        if box is not None:
+            image.thumbnail(box, Image.LANCZOS)
+
+        files = {}
+        for extension, options in image_profiles["formats"].items():
+            image_path = (
+                output_folder / f"printing_{card_id}_{index}_{name}.{extension}"
+            )
+            image.save(image_path, **options)
+            files[extension] = {
+                "file": image_path.name,
+                "bytes": image_path.stat().st_size,
+            }
+        sizes[name] = {"width": image.width, "height": image.height, "files": files}
+
+    manifest = {"source": source, "profiles": profiles, "sizes": sizes}
+    temporary = manifest_path.with_name(f"{manifest_path.name}.tmp")
+    temporary.write_text(json.dumps(manifest, indent=2))
+    temporary.replace(manifest_path)
+
+
+def init_image_worker(profiles: dict[str, dict]) -> None:
+    global image_profiles
+    image_profiles = profiles
+
+
+def timed_image_path(*args) -> float:
+    """Run get_image_path in a worker process, returning the time it took"""
+    start = time.perf_counter()
+    get_image_path(*args)
+    return time.perf_counter() - start
+
+
+class ImagePipeline:
+    """Generate the image derivatives in a process pool, off the ingest path
+
+    At most max_pending images are queued at once, so a slow pool throttles
+    card conversion instead of piling up work in memory.
+    """
+
+    PROGRESS_EVERY = 100
+
+    def __init__(self, workers: int, max_pending: int | None = None) -> None:
+        self.executor = ProcessPoolExecutor(
+            workers, initializer=init_image_worker, initargs=(image_profiles,)
+        )
+        self.max_pending = max_pending or workers * 4
+        self.pending: dict[Future, str] = {}
+        self.submitted = 0
+        self.failed = 0
+        self.timings: list[float] = []
+
+    def __enter__(self) -> ImagePipeline:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def submit(
+        self,
+        card_id: str,
+        path: Path,
+        edition_acronym_: str,
+        number: str,
+        index: int,
+    ) -> None:
+        if len(self.pending) >= self.max_pending:
+            done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+            self.collect(done)
+
+        future = self.executor.submit(
+            timed_image_path, card_id, path, edition_acronym_, number, index
+        )
+        self.pending[future] = path.stem
+        self.submitted += 1
+
+    def collect(self, done: Iterable[Future]) -> None:
+        for future in done:
+            image_name = self.pending.pop(future)
+            try:
+                elapsed = future.result()
+            except Exception:
+                logger.exception("Image %s failed", image_name)
+                self.failed += 1
+                continue
+
+            self.timings.append(elapsed)
+            if profile is not None:
+                profile.add("image_encode", elapsed)
+            logger.debug("Image %s generated in %.3fs", image_name, elapsed)
+            if len(self.timings) % self.PROGRESS_EVERY == 0:
+                logger.info(
+                    "Images: %s/%s generated", len(self.timings), self.submitted
+                )
+
+    def close(self) -> None:
+        done, _ = wait(self.pending)
+        self.collect(done)
+        self.executor.shutdown()
+
+        if self.timings:
+            timings = sorted(self.timings)
+            logger.info(
+                "%s images generated, %s failed: mean %.3fs, p95 %.3fs, max %.3fs",
+                len(timings),
+                self.failed,
+                sum(timings) / len(timings),
+                timings[int(len(timings) * 0.95)],
+                timings[-1],
+            )
+
+
+class DeferredImages:
+    """Stands in for the image pipeline in conversion workers
+
+    The images to generate are handed back with the converted cards, to the
+    main process which owns the pipeline.
+    """
+
+    def __init__(self) -> None:
+        self.jobs: list[tuple] = []
 
-    # Resize to 150*210
-    image.thumbnail((150, 210))
-    image.save(select_path)
+    def submit(self, *args) -> None:
+        self.jobs.append(args)
+
+
+image_pipeline: ImagePipeline | DeferredImages | None = None
+generate_images = True
 
 
 NUMBER_PATTERN = re.compile(r"(\d+)")
@@ -147,9 +492,14 @@ def get_printing(xml_item: ET.Element, card_id: str) -> list[dict[str, str]]:
         image_name = Path(xml_printing.text).stem
 
         number = NUMBER_PATTERN.search(image_name).group(1)
-        logger.info("Processing printing %s from edition %s", number, edition)
+        logger.debug("Processing printing %s from edition %s", number, edition)
 
-        get_image_path(card_id, image_name, edition_acronym, number, index)
+        if generate_images and (path := find_source_image(card_id, image_name)):
+            if image_pipeline is not None:
+                image_pipeline.submit(card_id, path, edition_acronym, number, index)
+            else:
+                with profiled("image_encode"):
+                    get_image_path(card_id, path, edition_acronym, number, index)
 
         printing = {
             "set": [edition],
@@ -162,24 +512,44 @@ def get_printing(xml_item: ET.Element, card_id: str) -> list[dict[str, str]]:
             "printimagehash": [f"{edition_acronym}/{number}"],
             "flavor": [flavor],
         }
+        if generate_images and path:
+            # Relative to printimagehash, lists the generated sizes and formats
+            printing["imagemanifest"] = [image_manifest_name(card_id, index)]
         printings.append(printing)
 
     return printings
 
 
-TOKEN_REPLACEMENTS = [
-    ("[BOW]", ":bow:"),
-    ("[FAVOR]", ":favor:"),
-]
-PAY_PATTERN = re.compile(r"\[PAY ([\d*]+)\]")
+# [TOKEN] -> emoji shortcode, [PAY n] is handled by the last alternative
+TOKEN_REPLACEMENTS = {
+    "[BOW]": ":bow:",
+    "[FAVOR]": ":favor:",
+}
+TOKEN_PATTERN = re.compile(
+    "|".join(map(re.escape, TOKEN_REPLACEMENTS)) + r"|\[PAY ([\d*]+)\]"
+)
+TAG_PATTERN = re.compile(r"<[^>]+>")
+
+KEYWORD_TYPES = frozenset({"Holding", "Item", "Personality", "Sensei", "Strategy"})
+# Keywords that make the first line of these card types a keyword line
+CHECKED_KEYWORDS = {
+    card_type: frozenset(KEYWORDS.get(card_type, set()) | KEYWORDS["Generic"])
+    for card_type in ("Holding", "Strategy", "Item")
+}
 
 KEPT = set()
 
 
+def replace_token(match: re.Match) -> str:
+    if (amount := match.group(1)) is not None:
+        return f":g{amount}:"
+    return TOKEN_REPLACEMENTS[match.group(0)]
+
+
 def convert_text(text: str, card_type: str) -> tuple[str, list[str]]:
     global KEPT
 
-    if card_type in {"Holding", "Item", "Personality", "Sensei", "Strategy"}:
+    if card_type in KEYWORD_TYPES:
         parts = text.split("<br>", maxsplit=1)
         if len(parts) == 2:
             keywords_, text = parts
@@ -198,26 +568,19 @@ def convert_text(text: str, card_type: str) -> tuple[str, list[str]]:
     cleaned_keywords: list[str] = []
     for keyword in keywords:
         # Remove HTML tags
-        keyword = re.sub(r"<[^>]+>", "", keyword)
-        keyword = keyword.strip()
+        keyword = TAG_PATTERN.sub("", keyword).strip()
         if keyword:
             cleaned_keywords.append(keyword)
 
-    if card_type in {"Holding", "Strategy", "Item"}:
-        if not any(
-            x in cleaned_keywords
-            for x in KEYWORDS.get(card_type, set()) | KEYWORDS["Generic"]
-        ):
+    if (checked := CHECKED_KEYWORDS.get(card_type)) is not None:
+        if checked.isdisjoint(cleaned_keywords):
             text = keywords_ + "<br>" + text
             cleaned_keywords = []
         if card_type == "Item":
             KEPT |= set(cleaned_keywords)
 
-    for token, replacement in TOKEN_REPLACEMENTS:
-        text = text.replace(token, replacement)
-
-    if "[PAY " in text:
-        text = PAY_PATTERN.sub(r":g\1:", text)
+    if "[" in text:
+        text = TOKEN_PATTERN.sub(replace_token, text)
 
     text = text.strip().removeprefix("<br>").strip()
 
@@ -250,15 +613,17 @@ def xml_to_dict(xml_item: ET.Element) -> dict[str, str]:
         raise KeyError("Deck not found")
 
     card_name = xml_item.find("name").text
-    logger.info("Processing card %s", card_name)
+    logger.debug("Processing card %s", card_name)
 
     card_id = xml_item.attrib["id"]
     card_type = TYPE_MAPPING[xml_item.attrib["type"]]
 
-    text, keywords = convert_text(xml_item.find("text").text, card_type)
+    with profiled("convert_text"):
+        text, keywords = convert_text(xml_item.find("text").text, card_type)
     printings = get_printing(xml_item, card_id)
 
     card = {
+        "id": card_id,
         "printingprimary": str(printings[0]["printingid"]),
         "imagehash": printings[0]["printimagehash"][0],
         "title": [card_name],
@@ -331,11 +696,26 @@ def xml_to_dict(xml_item: ET.Element) -> dict[str, str]:
                 }
             )
             if (xml_cost := xml_item.find("cost")) is not None:
-                card["cost"] = xml_cost.text
+                card["cost"] = [xml_cost.text]
+
+    add_numeric_fields(card)
 
     return card
 
 
+# Card statistics also indexed as int32, "-" or "*" values are left out
+NUMERIC_FIELDS = ("cost", "force", "chi", "focus", "ph", "honor", "production")
+NUMERIC_PATTERN = re.compile(r"^\s*([+-]?\d+)\s*$")
+
+
+def add_numeric_fields(card: dict) -> None:
+    for field in NUMERIC_FIELDS:
+        for value in card.get(field, []):
+            if value and (match := NUMERIC_PATTERN.match(value)):
+                card[f"{field}_value"] = int(match.group(1))
+                break
+
+
 class Printing(TypedDict):
     """
     {
@@ -372,6 +752,7 @@ class Printing(TypedDict):
     rarity: list[str]
     text: list[str]
     printimagehash: list[str]
+    imagemanifest: NotRequired[list[str]]
 
 
 class ExpectedCard(TypedDict):
@@ -470,12 +851,163 @@ class ExpectedCard(TypedDict):
     cost: list[str]
 
 
-def create_collection(documents: ET.tree, overwrite: bool = True) -> None:
-    """Turn a XML schema into a Typesense schema"""
+DEFAULT_BATCH_SIZE = 200
+
+
+COLLECTION_ALIAS = "l5r"
+DEFAULT_KEEP_VERSIONS = 2
+
+
+def iter_cards(database: Path) -> Iterator[ET.Element]:
+    """Stream <card> elements out of the Oracle XML database
+
+    Each element is cleared once the consumer is done with it, along with the
+    already processed siblings, so memory stays flat whatever the file size.
+    """
+    start = time.perf_counter()
+    for _, element in ET.iterparse(str(database), events=("end",), tag="card"):
+        if profile is not None:
+            profile.add("xml_parse", time.perf_counter() - start)
+        yield element
+
+        element.clear(keep_tail=True)
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+        start = time.perf_counter()
+
+
+def convert_card(card: ET.Element) -> dict:
+    start = time.perf_counter()
+    with profiled("xml_to_dict"):
+        card_dict = xml_to_dict(card)
+    if profile is not None and card_dict:
+        profile.cards.append(time.perf_counter() - start)
+    return card_dict
+
+
+CONVERT_CHUNK_SIZE = 64
+
+
+def init_converter(
+    index: ImageIndex | None,
+    generate: bool,
+    defer_images: bool,
+    profiling: bool,
+    profiles: dict[str, dict],
+) -> None:
+    """Set up a conversion worker with the state of the main process"""
+    global image_index, generate_images, image_pipeline, profile, image_profiles
+    image_index = index
+    image_profiles = profiles
+    generate_images = generate
+    image_pipeline = DeferredImages() if defer_images else None
+    profile = Profile() if profiling else None
+
+
+def convert_chunk(chunk: list[bytes]) -> dict[str, Any]:
+    """Convert serialized <card> elements in a worker
+
+    The global side effects of the conversion are returned along with the
+    cards, for the main process to merge.
+    """
+    KEPT.clear()
+    MISSING_IMAGES.clear()
+    if isinstance(image_pipeline, DeferredImages):
+        image_pipeline.jobs.clear()
+    if profile is not None:
+        profile.stages.clear()
+        profile.cards.clear()
+
+    cards = [convert_card(ET.fromstring(x)) for x in chunk]
+
+    return {
+        "cards": cards,
+        "kept": set(KEPT),
+        "missing": list(MISSING_IMAGES),
+        "images": image_pipeline.jobs if image_pipeline is not None else [],
+        "stages": dict(profile.stages) if profile is not None else {},
+        "latencies": profile.cards if profile is not None else [],
+    }
+
+
+def merge_chunk(result: dict[str, Any]) -> list[dict]:
+    KEPT.update(result["kept"])
+    MISSING_IMAGES.extend(result["missing"])
+    for args in result["images"]:
+        image_pipeline.submit(*args)
+    if profile is not None:
+        profile.merge(result["stages"], result["latencies"])
+    return result["cards"]
+
+
+def iter_card_dicts(cards: Iterable[ET.Element], workers: int = 0) -> Iterator[dict]:
+    """Converted cards, in the order of the database
+
+    With workers, the cards are serialized in chunks to a process pool and the
+    main process only parses the XML and uploads.
+    """
+    if workers <= 0:
+        for card in cards:
+            yield convert_card(card)
+        return
+
+    global image_index
+    if generate_images and image_index is None:
+        image_index = ImageIndex.build(IMAGE_FOLDER)
+
+    serialized = (ET.tostring(x, with_tail=False) for x in cards)
+    with ProcessPoolExecutor(
+        workers,
+        initializer=init_converter,
+        initargs=(
+            image_index,
+            generate_images,
+            image_pipeline is not None,
+            profile is not None,
+            image_profiles,
+        ),
+    ) as executor:
+        pending: deque[Future] = deque()
+        while chunk := list(itertools.islice(serialized, CONVERT_CHUNK_SIZE)):
+            pending.append(executor.submit(convert_chunk, chunk))
+            # Bounded read-ahead, results are consumed in submission order
+            if len(pending) >= workers * 2:
+                yield from merge_chunk(pending.popleft().result())
+        while pending:
+            yield from merge_chunk(pending.popleft().result())
+
+
+def create_collection(
+    cards: Iterable[ET.Element],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    keep_versions: int = DEFAULT_KEEP_VERSIONS,
+    manifest: Path | None = None,
+    incremental: bool = False,
+    invalidate_url: str | None = None,
+    invalidate_token: str | None = None,
+    workers: int = 0,
+    snapshot: Path | None = None,
+    shards: Path | None = None,
+) -> str:
+    """Turn a XML schema into a Typesense schema
+
+    Cards are ingested into a new versioned collection (l5r_<timestamp>) while
+    the live one keeps serving, then the l5r alias is swapped over to it.
+
+    In incremental mode, the live collection is updated in place: only the
+    cards whose converted document hash differs from the manifest are sent.
+
+    Every converted card is also written to the snapshot file and to the
+    static shards, if any.
+    """
+    previous, previous_ranks = load_manifest(manifest)
+    if incremental and not previous:
+        logger.warning("No manifest to compare against, running a full ingest")
+        incremental = False
+
     schema = {
-        "name": "l5r",
+        "name": f"{COLLECTION_ALIAS}_{time.strftime('%Y%m%d%H%M%S')}",
         "fields": [
-            {"name": "id", "type": "int32", "facet": True},
             {"name": "type", "type": "string[]", "facet": True},
             {
                 "name": "formattedtitle",
@@ -486,6 +1018,7 @@ def create_collection(documents: ET.tree, overwrite: bool = True) -> None:
                 "name": "title",
                 "type": "string[]",
             },
+            {"name": "title_rank", "type": "int32", "sort": True, "optional": True},
             {
                 "name": "cardid",
                 "type": "string",
@@ -498,34 +1031,423 @@ def create_collection(documents: ET.tree, overwrite: bool = True) -> None:
             # {"name": "edition", "type": "string", "facet": True},
             # {"name": "image", "type": "string",},
             # {"name": "legal", "type": "string", "facet": True},
-            # {"name": "cost", "type": "int32", "facet": True},
-            # {"name": "focus", "type": "int32", "facet": True},
+            *(
+                {
+                    "name": f"{field}_value",
+                    "type": "int32",
+                    "facet": True,
+                    "sort": True,
+                    "optional": True,
+                }
+                for field in NUMERIC_FIELDS
+            ),
         ],
     }
+    snapshot_writer = (
+        SnapshotWriter(snapshot, schema["name"]) if snapshot is not None else None
+    )
+    shard_writer = ShardWriter(shards) if shards is not None else None
+    version = schema["name"]
     try:
-        client.collections.create(schema)
-        logging.info("Collection %s created", schema["name"])
-    except typesense.exceptions.ObjectAlreadyExists:
-        logging.info("Collection %s already exists", schema["name"])
-        if overwrite:
-            logging.info("Overwriting collection %s", schema["name"])
-            client.collections[schema["name"]].delete()
+        if incremental:
+            schema["name"] = COLLECTION_ALIAS
+        else:
             client.collections.create(schema)
-            logging.info("Collection %s created", schema["name"])
+            logger.info("Collection %s created", schema["name"])
+
+        hashes: dict[str, str] = {}
+        titles: dict[str, str] = {}
+        sent: set[str] = set()
+        attributes: dict[str, set[str]] = defaultdict(set)
+        expected = 0
+        imported = 0
+        errors: list[dict] = []
+        start = time.perf_counter()
+
+        batch: list[dict] = []
+        for card_dict in iter_card_dicts(cards, workers):
+            if not card_dict:
+                continue
+
+            update_attributes(attributes, card_dict)
+            titles[card_dict["cardid"]] = card_dict["formattedtitle"]
+            hashes[card_dict["cardid"]] = card_hash(card_dict)
+            # Served as the ETag of the card by /oracle-fetch
+            card_dict["content_hash"] = hashes[card_dict["cardid"]]
+            if snapshot_writer is not None:
+                snapshot_writer.add(card_dict)
+            if shard_writer is not None:
+                shard_writer.add(card_dict)
+            if (
+                incremental
+                and previous.get(card_dict["cardid"]) == hashes[card_dict["cardid"]]
+            ):
+                logger.debug("Document %s unchanged", card_dict["formattedtitle"])
+                continue
+
+            expected += 1
+            sent.add(card_dict["cardid"])
+            batch.append(card_dict)
+            if len(batch) >= batch_size:
+                imported += import_batch(schema["name"], batch, errors)
+                batch = []
+
+        if batch:
+            imported += import_batch(schema["name"], batch, errors)
+
+        removed = [card_id for card_id in previous if card_id not in hashes]
+        if incremental:
+            delete_documents(schema["name"], removed)
+
+        elapsed = time.perf_counter() - start
+
+        for error in errors:
+            logger.error(
+                "Document %s failed: %s", error.get("document"), error.get("error")
+            )
+            # Keep the previous hash so that the card is retried on the next run
+            if error["document"] in previous:
+                hashes[error["document"]] = previous[error["document"]]
+            else:
+                hashes.pop(error["document"], None)
+                titles.pop(error["document"], None)
+
+        logger.info("Holding keywords: %s", KEPT)
+        logger.info(
+            "%s cards imported, %s errors in %.2fs (%.1f cards/s)",
+            imported,
+            len(errors),
+            elapsed,
+            imported / elapsed if elapsed else 0,
+        )
+
+        num_documents = client.collections[schema["name"]].retrieve()["num_documents"]
+        if not incremental and num_documents != expected:
+            logger.error(
+                "Collection %s has %s documents, expected %s: keeping the live version",
+                schema["name"],
+                num_documents,
+                expected,
+            )
+            client.collections[schema["name"]].delete()
+            raise RuntimeError(f"Validation of collection {schema['name']} failed")
+
+        ranks = title_ranks(titles)
+        if incremental:
+            # Upserted documents lost their rank, the others only need it if it moved
+            changed = {
+                card_id: rank
+                for card_id, rank in ranks.items()
+                if card_id in sent or previous_ranks.get(card_id) != rank
+            }
+        else:
+            changed = ranks
+        for card_id in update_title_ranks(schema["name"], changed, batch_size):
+            # Not saved, so that the rank is sent again on the next run
+            ranks.pop(card_id)
+
+        if not incremental:
+            publish_collection(schema["name"])
+            delete_old_collections(schema["name"], keep_versions)
+
+        save_attributes(attributes)
+        if snapshot_writer is not None:
+            snapshot_writer.commit()
+    except BaseException:
+        # Don't leave the temporary file of the snapshot behind
+        if snapshot_writer is not None:
+            snapshot_writer.abort()
+        raise
+    if shard_writer is not None:
+        shard_writer.write(version)
+
+    if invalidate_url is not None:
+        invalidate_cache(invalidate_url, invalidate_token)
+
+    if manifest is not None:
+        save_manifest(manifest, hashes, ranks)
+    if previous:
+        log_updates(previous, hashes)
+
+    return schema["name"]
 
-    for card in documents.findall("card"):
-        card_dict = xml_to_dict(card)
 
-        if not card_dict:
+ATTRIBUTES_COLLECTION = "attributes"
+
+
+def update_attributes(attributes: dict[str, set[str]], card_dict: dict) -> None:
+    """Collect the values of the fields the frontend offers in its pull-downs"""
+    for lookup in ("type", "clan", "deck", "legality"):
+        attributes[lookup].update(card_dict.get(lookup, []))
+
+    for printing in card_dict["printing"]:
+        attributes["printing.rarity"].update(printing["rarity"])
+        for set_ in printing["set"]:
+            attributes[f"printing.set={set_}"].update(printing["rarity"])
+
+
+def build_attributes(attributes: dict[str, set[str]]) -> dict[str, Any]:
+    """/attributes payloads, one per lookup, as documented in docs/API.md"""
+    payloads: dict[str, Any] = {
+        lookup: sorted(values)
+        for lookup, values in attributes.items()
+        if not lookup.startswith("printing.set=")
+    }
+    payloads["printing.set:printing.rarity"] = group_by_arc(
+        {
+            lookup.removeprefix("printing.set="): sorted(values)
+            for lookup, values in sorted(attributes.items())
+            if lookup.startswith("printing.set=")
+        }
+    )
+    return payloads
+
+
+def save_attributes(attributes: dict[str, set[str]]) -> None:
+    try:
+        client.collections.create(
+            {
+                "name": ATTRIBUTES_COLLECTION,
+                "fields": [
+                    {"name": "database", "type": "string", "facet": True},
+                    {"name": "lookup", "type": "string", "facet": True},
+                    {"name": "payload", "type": "string", "index": False},
+                ],
+            }
+        )
+    except typesense.exceptions.ObjectAlreadyExists:
+        pass
+
+    client.collections[ATTRIBUTES_COLLECTION].documents.import_(
+        [
+            {
+                "id": f"{COLLECTION_ALIAS}:{lookup}",
+                "database": COLLECTION_ALIAS,
+                "lookup": lookup,
+                "payload": json.dumps(payload),
+            }
+            for lookup, payload in build_attributes(attributes).items()
+        ],
+        {"action": "upsert"},
+    )
+    logger.info("Attributes saved")
+
+
+def invalidate_cache(url: str, token: str | None = None) -> None:
+    """Tell the API server to drop the cards and searches it cached"""
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    try:
+        with urllib.request.urlopen(
+            urllib.request.Request(url, headers=headers, method="POST"), timeout=10
+        ) as response:
+            logger.info("Cache invalidated: %s", response.read().decode("utf-8"))
+    except OSError:
+        logger.exception("Could not invalidate the cache at %s", url)
+
+
+def card_hash(card_dict: dict) -> str:
+    return hashlib.sha1(
+        json.dumps(card_dict, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def load_manifest(manifest: Path | None) -> tuple[dict[str, str], dict[str, int]]:
+    """cardid -> hash of the converted document, and cardid -> title rank, as of
+    the last ingest
+
+    Manifests written before title ranks were tracked only hold the hashes.
+    """
+    if manifest is None or not manifest.exists():
+        return {}, {}
+    data = json.loads(manifest.read_text())
+    if "cards" not in data:
+        return data, {}
+    return data["cards"], data["title_ranks"]
+
+
+def save_manifest(
+    manifest: Path, hashes: dict[str, str], ranks: dict[str, int]
+) -> None:
+    manifest.write_text(
+        json.dumps({"cards": hashes, "title_ranks": ranks}, sort_keys=True, indent=0)
+    )
+    logger.info("Manifest %s saved with %s cards", manifest, len(hashes))
+
+
+def delete_documents(collection_name: str, card_ids: list[str]) -> None:
+    for start in range(0, len(card_ids), DEFAULT_BATCH_SIZE):
+        chunk = card_ids[start : start + DEFAULT_BATCH_SIZE]
+        client.collections[collection_name].documents.delete(
+            {"filter_by": f"cardid:=[{','.join(chunk)}]"}
+        )
+        logger.info("Deleted %s documents", len(chunk))
+
+
+UPDATELOG_COLLECTION = "updatelog"
+
+
+def log_updates(previous: dict[str, str], hashes: dict[str, str]) -> None:
+    """Record the cards added, updated and deleted by this run in the update log"""
+    operations = {
+        "add": [card_id for card_id in hashes if card_id not in previous],
+        "update": [
+            card_id
+            for card_id, hash_ in hashes.items()
+            if card_id in previous and previous[card_id] != hash_
+        ],
+        "delete": [card_id for card_id in previous if card_id not in hashes],
+    }
+
+    try:
+        client.collections.create(
+            {
+                "name": UPDATELOG_COLLECTION,
+                "fields": [
+                    {"name": "database", "type": "string", "facet": True},
+                    {"name": "cardids", "type": "string[]"},
+                    {"name": "operation", "type": "string", "facet": True},
+                    {"name": "uname", "type": "string"},
+                    {"name": "uid", "type": "string"},
+                    {"name": "timestamp", "type": "int64", "sort": True},
+                ],
+                "default_sorting_field": "timestamp",
+            }
+        )
+    except typesense.exceptions.ObjectAlreadyExists:
+        pass
+
+    timestamp = int(time.time() * 1000)
+    for operation, card_ids in operations.items():
+        if not card_ids:
             continue
 
+        client.collections[UPDATELOG_COLLECTION].documents.create(
+            {
+                "database": COLLECTION_ALIAS,
+                "cardids": card_ids,
+                "operation": operation,
+                "uname": "ingestor",
+                "uid": "ingestor",
+                "timestamp": timestamp,
+            }
+        )
+        logger.info("Update log: %s %s cards", operation, len(card_ids))
+
+
+def publish_collection(collection_name: str) -> None:
+    """Atomically point the alias at a freshly ingested collection"""
+    try:
+        client.collections[COLLECTION_ALIAS].retrieve()
+    except typesense.exceptions.ObjectNotFound:
+        pass
+    else:
+        # An alias can't shadow a collection: drop the pre-versioning one
         try:
-            client.collections[schema["name"]].documents.create(card_dict)
-            logging.info("Document %s created", card_dict["formattedtitle"])
-        except typesense.exceptions.ObjectAlreadyExists:
-            logging.info("Document %s already exists", card_dict["formattedtitle"])
+            client.aliases[COLLECTION_ALIAS].retrieve()
+        except typesense.exceptions.ObjectNotFound:
+            logger.warning("Deleting unversioned collection %s", COLLECTION_ALIAS)
+            client.collections[COLLECTION_ALIAS].delete()
+
+    client.aliases.upsert(COLLECTION_ALIAS, {"collection_name": collection_name})
+    logger.info("Alias %s now points to %s", COLLECTION_ALIAS, collection_name)
+
+
+def delete_old_collections(current: str, keep_versions: int) -> None:
+    """Garbage-collect versioned collections, keeping the most recent ones"""
+    versions = sorted(
+        (
+            collection["name"]
+            for collection in client.collections.retrieve()
+            if collection["name"].startswith(f"{COLLECTION_ALIAS}_")
+            and collection["name"] != current
+        ),
+        reverse=True,
+    )
+    for name in versions[max(keep_versions - 1, 0) :]:
+        logger.info("Deleting old collection %s", name)
+        client.collections[name].delete()
+
+
+def import_batch(collection_name: str, batch: list[dict], errors: list[dict]) -> int:
+    """Upsert a batch of documents, collecting the per-document JSONL errors"""
+    with profiled("upload"):
+        results = client.collections[collection_name].documents.import_(
+            batch, {"action": "upsert"}
+        )
+
+    imported = 0
+    for card_dict, result in zip(batch, results):
+        if result.get("success"):
+            imported += 1
+            logger.debug("Document %s imported", card_dict["formattedtitle"])
+        else:
+            errors.append(
+                {
+                    "document": card_dict["cardid"],
+                    "error": result.get("error"),
+                    "code": result.get("code"),
+                }
+            )
 
-    logger.info("Holding keywords: %s", KEPT)
+    logger.info("Imported %s/%s documents", imported, len(batch))
+    return imported
+
+
+def title_ranks(titles: dict[str, str]) -> dict[str, int]:
+    """cardid -> position of the card in title order
+
+    Typesense can only range filter numbers, the rank is what keyset pagination
+    of /search compares against when sorting on the title.
+    """
+    return {
+        card_id: rank
+        for rank, card_id in enumerate(
+            sorted(titles, key=lambda x: (titles[x].lower(), x))
+        )
+    }
+
+
+def update_title_ranks(
+    collection_name: str, ranks: dict[str, int], batch_size: int
+) -> list[str]:
+    """Ranks depend on every title, so they are set once all cards are in
+
+    Returns the cardids whose rank could not be updated.
+    """
+    documents = [{"id": card_id, "title_rank": rank} for card_id, rank in ranks.items()]
+    failed = []
+    for position in range(0, len(documents), batch_size):
+        batch = documents[position : position + batch_size]
+        with profiled("upload"):
+            results = client.collections[collection_name].documents.import_(
+                batch, {"action": "update"}
+            )
+        for document, result in zip(batch, results):
+            if not result.get("success"):
+                failed.append(document["id"])
+                logger.error(
+                    "Title rank of %s failed: %s", document["id"], result.get("error")
+                )
+
+    logger.info("Updated %s title ranks", len(documents) - len(failed))
+    return failed
+
+
+def report_missing_images(report: Path | None = None) -> None:
+    if not MISSING_IMAGES:
+        return
+
+    logger.warning("%s images not found", len(MISSING_IMAGES))
+    if report is not None:
+        report.write_text(
+            "".join(
+                f"{card_id}\t{image_name}\n" for card_id, image_name in MISSING_IMAGES
+            )
+        )
+        logger.warning("Missing images listed in %s", report)
+    else:
+        for card_id, image_name in MISSING_IMAGES:
+            logger.warning("Image %s of card %s not found", image_name, card_id)
 
 
 def main():
@@ -536,17 +1458,127 @@ def main():
         help="Path to the file containing the data to be ingested",
     )
 
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Number of documents sent per import request",
+    )
+    parser.add_argument(
+        "--keep-versions",
+        type=int,
+        default=DEFAULT_KEEP_VERSIONS,
+        help="Number of collection versions kept, including the live one",
+    )
+    parser.add_argument(
+        "--image-workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Processes generating card images, 0 to generate them inline",
+    )
+    parser.add_argument(
+        "--convert-workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Processes converting the XML cards, 0 to convert them inline",
+    )
+    parser.add_argument(
+        "--skip-images",
+        action="store_true",
+        help="Only ingest the cards, without generating their images",
+    )
+    parser.add_argument(
+        "--image-index",
+        type=Path,
+        help="File caching the image packs index between runs",
+    )
+    parser.add_argument(
+        "--image-profiles",
+        type=Path,
+        help="JSON file with the image sizes and formats to generate, "
+        'e.g. {"sizes": {"select": [150, 210]}, "formats": {"webp": {"format": '
+        '"WEBP", "quality": 80}}}',
+    )
+    parser.add_argument(
+        "--missing-images",
+        type=Path,
+        help="File listing the printings whose source image was not found",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        help="JSON file tracking the hash of every ingested card",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only send the cards that changed since the manifest was written",
+    )
+    parser.add_argument(
+        "--invalidate-url",
+        help="API endpoint to call once cards are published, e.g. "
+        "http://localhost:8000/cache/invalidate",
+    )
+    parser.add_argument(
+        "--invalidate-token",
+        default=os.environ.get("OOTV_INVALIDATE_TOKEN"),
+        help="Secret sent to --invalidate-url, as configured on the API "
+        "(default: $OOTV_INVALIDATE_TOKEN)",
+    )
+    parser.add_argument(
+        "--snapshot",
+        type=Path,
+        help="Also write the converted cards to this file, which the API can serve",
+    )
+    parser.add_argument(
+        "--shards",
+        type=Path,
+        help="Also write gzipped JSON shards of the cards (per deck, per set and "
+        "an index) to this directory, for static hosting",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        help="Write the time spent per stage and the card throughput to this JSON",
+    )
+
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
 
     init_client()
 
-    with open(args.database) as f:
-        xml = ET.parse(f)
+    global generate_images, image_index, image_pipeline, profile, image_profiles
+    if args.profile is not None:
+        profile = Profile()
+    image_profiles = load_image_profiles(args.image_profiles)
+    generate_images = not args.skip_images
+    if generate_images:
+        image_index = ImageIndex.load(IMAGE_FOLDER, args.image_index)
+    if generate_images and args.image_workers > 0:
+        image_pipeline = ImagePipeline(args.image_workers)
 
-    root = xml.getroot()
-    create_collection(root)
+    try:
+        create_collection(
+            iter_cards(args.database),
+            batch_size=args.batch_size,
+            keep_versions=args.keep_versions,
+            manifest=args.manifest,
+            incremental=args.incremental,
+            invalidate_url=args.invalidate_url,
+            invalidate_token=args.invalidate_token,
+            workers=args.convert_workers,
+            snapshot=args.snapshot,
+            shards=args.shards,
+        )
+    finally:
+        if image_pipeline is not None:
+            image_pipeline.close()
+
+    report_missing_images(args.missing_images)
+
+    if profile is not None:
+        profile.write(args.profile)
 
 
 if __name__ == "__main__":
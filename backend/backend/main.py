@@ -1,21 +1,45 @@
 from __future__ import annotations
 
+import argparse
+import asyncio
+import base64
+import binascii
+import gzip
+import hashlib
+import hmac
 import json
 import logging
+import os
+import re
+import secrets
+import time
 import urllib.parse
-from typing import Any, Dict, List, Literal, TypedDict
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Literal, TypedDict
 
-import typesense
-import typesense.collection
-from fastapi import FastAPI, Request
+import orjson
+import typesense.exceptions
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from pydantic import BaseModel, Field
 
-from . import mappings
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from . import mappings, metrics
+from .cache import LRUCache
+from .embedded import EmbeddedEngine
+from .engine import TypesenseEngine
+from .metrics import stage
+from .snapshot import Snapshot
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 
 # Liste des origines autorisées (mettez les vôtres ici)
@@ -37,305 +61,312 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    """Count and time every request, and expose its stages as Server-Timing"""
+    current: dict[str, float] = {}
+    metrics.timings.set(current)
+    start = time.perf_counter()
+
+    response = await call_next(request)
+
+    elapsed = time.perf_counter() - start
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.REQUESTS.inc(route, str(response.status_code))
+    metrics.REQUEST_LATENCY.observe(elapsed, route)
+    for name, seconds in current.items():
+        metrics.STAGE_LATENCY.observe(seconds, route, name)
+    response.headers["Server-Timing"] = metrics.server_timing(current, elapsed)
+
+    return response
+
+
+MAX_PER_PAGE = 250
+# Searches per multi_search request, Typesense's default limit
+MAX_MULTI_SEARCHES = 50
+
+# Smaller responses fit in a packet or two, compressing them isn't worth it
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSORS = {
+    **({"br": lambda x: brotli.compress(x, quality=5)} if brotli else {}),
+    "gzip": lambda x: gzip.compress(x, compresslevel=6),
+}
+
+
+card_cache = LRUCache(maxsize=20000, ttl=3600)
+search_cache = LRUCache(maxsize=2000, ttl=3600)
+# cardid -> JSON bytes of the card, spliced as is into the responses
+source_cache = LRUCache(maxsize=20000, ttl=3600)
+
+
+async def fetch_cards(cardids: list[str]) -> dict[str, dict]:
+    """Fetch cards by cardid with one filter_by query per page of uncached ids
+
+    The queries go in the body of multi_search requests, a page of quoted ids
+    is too long for the query string of a GET search.
+    """
+    cards = {}
+    for cardid in cardids:
+        if (card := card_cache.get(cardid)) is not None:
+            cards[cardid] = card
+
+    missing = [x for x in cardids if x not in cards]
+    searches = [
+        {
+            "q": "*",
+            "filter_by": f"cardid:=[{','.join(map(quote, chunk))}]",
+            "per_page": len(chunk),
+        }
+        for start in range(0, len(missing), MAX_PER_PAGE)
+        if (chunk := missing[start : start + MAX_PER_PAGE])
+    ]
+    with stage("engine"):
+        responses = await asyncio.gather(
+            *(
+                engine.multi_search(
+                    COLLECTION, searches[start : start + MAX_MULTI_SEARCHES]
+                )
+                for start in range(0, len(searches), MAX_MULTI_SEARCHES)
+            )
+        )
+    results = [x for response in responses for x in response]
+
+    for search_results in results:
+        for hit in search_results["hits"]:
+            cards[hit["document"]["cardid"]] = hit["document"]
+            card_cache.set(hit["document"]["cardid"], hit["document"])
+
+    return cards
+
+
 @app.get("/updatelog")
-async def updatelog(table: str, limit: int, fetchcards: bool):
+async def updatelog(
+    request: Request,
+    table: str,
+    limit: int = 10,
+    mintime: int | None = None,
+    fetchcards: bool = False,
+):
     """http://somosierra.flu:8000/updatelog?table=l5r&limit=110&fetchcards=true"""
-    return {
-        "logs": [],
-        "cardids": [],
+    filters = [f"database:={table}"]
+    if mintime is not None:
+        filters.append(f"timestamp:>{mintime}")
+
+    try:
+        with stage("engine"):
+            log_results = await engine.search(
+                "updatelog",
+                {
+                    "q": "*",
+                    "filter_by": " && ".join(filters),
+                    "sort_by": "timestamp:desc",
+                    "per_page": limit,
+                },
+            )
+    except typesense.exceptions.ObjectNotFound:
+        log_results = {"hits": []}
+
+    logs = [hit["document"] for hit in log_results["hits"]]
+    cardids = list(dict.fromkeys(x for log in logs for x in log["cardids"]))
+
+    hits = []
+    if fetchcards and cardids:
+        cards = await fetch_cards(cardids)
+        hits = [convert({"document": cards[x]}) for x in cardids if x in cards]
+
+    content = {
+        "logs": logs,
+        "cardids": cardids,
         "cards": {
             "took": 2,
             "timed_out": False,
             "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
             "hits": {
-                "total": 0,
+                "total": len(hits),
                 "max_score": 1,
-                "hits": [],
+                "hits": hits,
             },
         },
     }
+    with stage("serialize"):
+        body = orjson.dumps(content)
+    return json_response(request, body)
+
+
+def decode_body(body: bytes) -> dict[str, str | list[str]]:
+    """Decode a form body as jQuery sends it, in a single pass
+
+    b'field_clan%5B%5D=Crab&field_clan%5B%5D=Crane&querystring=iron+mine'
+    {'field_clan': ['Crab', 'Crane'], 'querystring': 'iron mine'}
+    """
+    params: dict[str, Any] = {}
+    for key, value in urllib.parse.parse_qsl(
+        body.decode("utf-8"), keep_blank_values=True
+    ):
+        key = key.removesuffix("[]")
+        if key not in params:
+            params[key] = value
+        elif isinstance(params[key], list):
+            params[key].append(value)
+        else:
+            params[key] = [params[key], value]
+
+    return params
 
 
 def get_attributes_query_params(body: bytes) -> dict[str, str]:
     """b'table=l5r&lookup=deck&optgroup=1'"""
-    query_params = {}
-    decoded_body = body.decode("utf-8")
-    for param in decoded_body.split("&"):
-        key, value = param.split("=")
-        query_params[key] = urllib.parse.unquote(value)
+    return {
+        key: value if isinstance(value, str) else value[-1]
+        for key, value in decode_body(body).items()
+    }
+
+
+ATTRIBUTES_COLLECTION = "attributes"
+
+
+def accepted_encoding(request: Request) -> str | None:
+    """Preferred encoding of COMPRESSORS the client accepts, brotli first"""
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        encoding, _, parameters = item.strip().partition(";")
+        if parameters.strip().replace(" ", "") not in {"q=0", "q=0.0", "q=0.00"}:
+            accepted.add(encoding.strip().lower())
+    return next((x for x in COMPRESSORS if x in accepted), None)
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """If-None-Match holds etag, whatever the encoding it was served with"""
+    for tag in request.headers.get("if-none-match", "").split(","):
+        tag = tag.strip().removeprefix("W/").strip('"')
+        base, _, encoding = tag.rpartition("-")
+        if tag in {"*", etag} or encoding in COMPRESSORS and base == etag:
+            return True
+    return False
+
+
+def json_response(
+    request: Request,
+    content: bytes | dict[str, bytes],
+    etag: str | None = None,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    """JSON body compressed as negotiated, content may cache the encodings
+
+    ETags are strong, each encoding gets its own.
+    """
+    with stage("serialize"):
+        return encode_response(request, content, etag, headers)
+
+
+def encode_response(
+    request: Request,
+    content: bytes | dict[str, bytes],
+    etag: str | None = None,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    variants = content if isinstance(content, dict) else {"identity": content}
+    headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+
+    body = variants["identity"]
+    encoding = accepted_encoding(request)
+    if len(body) < COMPRESSION_MIN_SIZE:
+        encoding = None
+
+    if etag is not None:
+        headers["ETag"] = f'"{etag}-{encoding}"' if encoding else f'"{etag}"'
+        if is_not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+
+    if encoding is not None:
+        if (compressed := variants.get(encoding)) is None:
+            compressed = variants[encoding] = COMPRESSORS[encoding](body)
+        body = compressed
+        headers["Content-Encoding"] = encoding
+
+    return Response(body, media_type="application/json", headers=headers)
+
+
+# lookup -> (serialized payload, ETag), computed by the ingestor
+attributes_payloads: dict[str, tuple[dict[str, bytes], str]] = {}
+
+
+def serialize_attribute(payload: Any) -> tuple[dict[str, bytes], str]:
+    data = json.dumps(payload).encode("utf-8")
+    return {"identity": data}, hashlib.sha1(data).hexdigest()
+
 
-    return query_params
+# Served until the ingestor has written the attributes collection
+FALLBACK_ATTRIBUTES = {
+    lookup: serialize_attribute(payload)
+    for lookup, payload in {
+        "type": list(dict.fromkeys(mappings.TYPE_MAPPING.values())),
+        "clan": list(dict.fromkeys(mappings.CLAN_MAPPING.values())),
+        "deck": list(mappings.DECK_MAPPING),
+        "legality": list(dict.fromkeys(mappings.LEGALITY_MAPPING.values())),
+        "printing.rarity": list(dict.fromkeys(mappings.RARITY_MAPPING.values())),
+        "printing.set:printing.rarity": mappings.group_by_arc(
+            {
+                set_: list(dict.fromkeys(mappings.RARITY_MAPPING.values()))
+                for set_ in dict.fromkeys(mappings.EXTENSION_MAPPING.values())
+            }
+        ),
+    }.items()
+}
 
 
-@app.post("/attributes")
+async def load_attributes() -> None:
+    try:
+        search_results = await engine.search(
+            ATTRIBUTES_COLLECTION,
+            {
+                "q": "*",
+                "filter_by": f"database:={COLLECTION}",
+                "per_page": MAX_PER_PAGE,
+            },
+        )
+    except typesense.exceptions.ObjectNotFound:
+        logger.warning("No attributes found, serving the mappings until an ingest")
+        return
+
+    attributes_payloads.clear()
+    for hit in search_results["hits"]:
+        payload = hit["document"]["payload"].encode("utf-8")
+        etag = hashlib.sha1(payload).hexdigest()
+        attributes_payloads[hit["document"]["lookup"]] = ({"identity": payload}, etag)
+
+    logger.info("Loaded attributes %s", list(attributes_payloads))
+
+
+@app.api_route("/attributes", methods=["GET", "POST"])
 async def attributes(request: Request):
-    query = get_attributes_query_params(await request.body())
-    match query["lookup"]:
-        case "legality":
-            return [
-                {
-                    "Arc": [
-                        "Clan&nbsp;Wars&nbsp;(Imperial)",
-                        "Hidden&nbsp;Emperor&nbsp;(Jade)",
-                        "Four&nbsp;Winds&nbsp;(Gold)",
-                        "Rain&nbsp;of&nbsp;Blood&nbsp;(Diamond)",
-                        "Race&nbsp;for&nbsp;the&nbsp;Throne&nbsp;(Samurai)",
-                        "Age&nbsp;of&nbsp;Enlightenment&nbsp;(Lotus)",
-                        "Destroyer&nbsp;War&nbsp;(Celestial)",
-                        "Age&nbsp;of&nbsp;Conquest&nbsp;(Emperor)",
-                        "A&nbsp;Brother's&nbsp;Destiny&nbsp;(Ivory&nbsp;Edition)",
-                        "A&nbsp;Brother's&nbsp;Destiny&nbsp;(Twenty&nbsp;Festivals)",
-                        "Onyx Edition",
-                        "Shattered&nbsp;Empire",
-                    ]
-                },
-                {"Format": ["Modern", "Obsidian Hand", "Big Deck"]},
-                {"Misc": ["Not&nbsp;Legal&nbsp;(Proxy)", "Unreleased"]},
-            ]
-        case "printing.rarity":
-            return list(mappings.RARITY_MAPPING.values())
-        case "type":
-            return list(mappings.TYPE_MAPPING.values())
-        case "deck":
-            return list(mappings.DECK_MAPPING.keys())
-        case "clan":
-            return list(mappings.CLAN_MAPPING.values())
-        case "printing.set:printing.rarity":
-            return [
-                {
-                    "Clan War (Imperial)": {
-                        "Pre-Imperial Edition": ["Fixed"],
-                        "Imperial Edition": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Shadowlands": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Forbidden Knowledge": ["Common", "Rare", "Uncommon"],
-                        "Emerald Edition": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Battle of Beiden Pass": ["Fixed"],
-                        "Anvil of Despair": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Crimson and Jade": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Obsidian Edition": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Time of the Void": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Scorpion Clan Coup 1": ["Common", "Fixed", "Uncommon"],
-                        "Scorpion Clan Coup 2": ["Common", "Uncommon"],
-                        "Scorpion Clan Coup 3": ["Common", "Fixed", "Uncommon"],
-                        "Promotional&ndash;Imperial": ["Promo"],
-                        "Promotional–Imperial": ["Promo"],
-                    }
-                },
-                {
-                    "The Hidden Emperor (Jade)": {
-                        "Jade Edition": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Hidden Emperor 1": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Hidden Emperor 2": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Hidden Emperor 3": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Hidden Emperor 4": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Hidden Emperor 5": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Hidden Emperor 6": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "The Dark Journey Home": [
-                            "Common",
-                            "Fixed",
-                            "Rare",
-                            "Uncommon",
-                        ],
-                        "Pearl Edition": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Siege of Sleeping Mountain": ["Fixed"],
-                        "Honor Bound": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Ambition's Debt": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Fire &amp; Shadow": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Top Deck Booster Pack": ["Fixed"],
-                        "Heroes of Rokugan": ["Fixed"],
-                        "Soul of the Empire": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Storms Over Matsu Palace": ["Fixed"],
-                        "The War of Spirits": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Promotional&ndash;Jade": ["Promo"],
-                        "Promotional–Jade": ["Promo"],
-                        "Promotional&ndash;CWF": ["Promo"],
-                    }
-                },
-                {
-                    "Four Winds (Gold)": {
-                        "Gold Edition": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "A Perfect Cut": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "An Oni's Fury": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Dark Allies": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "L5R Experience": ["Fixed"],
-                        "Broken Blades": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "1,000 Years of Darkness": ["Fixed"],
-                        "The Fall of Otosan Uchi": [
-                            "Common",
-                            "Fixed",
-                            "Rare",
-                            "Uncommon",
-                        ],
-                        "Heaven & Earth": ["Common", "Uncommon"],
-                        "Heaven &amp; Earth": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Winds of Change": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Promotional&ndash;Gold": ["Promo"],
-                    }
-                },
-                {
-                    "Rain of Blood (Diamond)": {
-                        "Diamond Edition": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Training Grounds": ["Fixed"],
-                        "Reign of Blood": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Hidden City": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Wrath of the Emperor": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Dawn of the Empire": ["Fixed"],
-                        "Web of Lies": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Enemy of My Enemy": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Code of Bushido": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Promotional&ndash;Diamond": ["Promo"],
-                    }
-                },
-                {
-                    "Age of Enlightenment (Lotus)": {
-                        "Lotus Edition": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Path of Hope": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Drums of War": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Training Grounds 2": ["Fixed"],
-                        "Test of Enlightenment": ["Fixed"],
-                        "Rise of the Shogun": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Khan's Defiance": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Tomorrow": ["Fixed"],
-                        "The Truest Test": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Promotional&ndash;Lotus": ["Promo"],
-                        "Crab vs. Lion": ["Fixed"],
-                    }
-                },
-                {
-                    "Race for the Throne (Samurai)": {
-                        "Samurai Edition": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Stronger Than Steel": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Test of the Emerald and Jade Championships": ["Fixed"],
-                        "Honor's Veil": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Words and Deeds": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Samurai Edition Banzai": ["Rare"],
-                        "The Heaven's Will": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Glory of the Empire": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "The Imperial Gift 1": ["Fixed"],
-                        "Death at Koten": ["Fixed"],
-                        "Promotional&ndash;Samurai": ["Fixed", "Promo"],
-                        "Promotional–Samurai": ["Promo"],
-                    }
-                },
-                {
-                    "The Destroyer War (Celestial)": {
-                        "Celestial Edition": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "The Imperial Gift 2": ["Fixed"],
-                        "Path of the Destroyer": [
-                            "Common",
-                            "Fixed",
-                            "Rare",
-                            "Uncommon",
-                        ],
-                        "The Harbinger": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Celestial Edition 15th Anniversary": [
-                            "Common",
-                            "Fixed",
-                            "Promo",
-                            "Rare",
-                            "Uncommon",
-                        ],
-                        "The Plague War": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "The Imperial Gift 3": ["Fixed"],
-                        "Battle of Kyuden Tonbo": ["Fixed"],
-                        "Empire at War": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "The Dead of Winter": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Before the Dawn": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "War of Honor": ["Fixed"],
-                        "Forgotten Legacy": ["Fixed"],
-                        "Second City": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Promotional&ndash;Celestial": ["Fixed", "Promo"],
-                        "Promotional–Celestial": ["Promo"],
-                    }
-                },
-                {
-                    "Age of Conquest (Emperor)": {
-                        "Emperor Edition": [
-                            "Common",
-                            "Fixed",
-                            "Premium",
-                            "Rare",
-                            "Uncommon",
-                        ],
-                        "Embers of War": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "The Shadow's Embrace": ["Fixed"],
-                        "Seeds of Decay": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Honor and Treachery": ["Fixed"],
-                        "Emperor Edition Gempukku": ["Fixed"],
-                        "Torn Asunder": ["Common", "Rare", "Uncommon"],
-                        "Coils of Madness": ["Fixed", "Premium"],
-                        "Gates of Chaos": ["Common", "Rare", "Uncommon"],
-                        "Aftermath": ["Common", "Rare", "Uncommon"],
-                        "Promotional&ndash;Emperor": ["Fixed", "Promo"],
-                        "Promotional–Emperor": ["Promo"],
-                        "Emperor Edition Demo Decks": ["Fixed"],
-                    }
-                },
-                {
-                    "A Brother's Destiny (Ivory)": {
-                        "A Matter of Honor": ["Fixed"],
-                        "Ivory Edition": [
-                            "Common",
-                            "Fixed",
-                            "Premium",
-                            "Rare",
-                            "Uncommon",
-                        ],
-                        "The Coming Storm": ["Common", "Premium", "Rare", "Uncommon"],
-                        "Siege: Heart of Darkness": ["Fixed"],
-                        "A Line in the Sand": ["Common", "Premium", "Rare", "Uncommon"],
-                        "The New Order": ["Common", "Premium", "Rare", "Uncommon"],
-                        "The Currency of War": ["Fixed"],
-                        "Promotional&ndash;Twenty Festivals": ["Promo"],
-                        "Twenty Festivals": [
-                            "Common",
-                            "Fixed",
-                            "Premium",
-                            "Rare",
-                            "Uncommon",
-                        ],
-                        "Thunderous Acclaim": ["Common", "Rare", "Uncommon"],
-                        "Siege: Clan War": ["Fixed"],
-                        "Evil Portents": ["Common", "Premium", "Rare", "Uncommon"],
-                        "The Blackest Storm": ["Common", "Fixed", "Rare", "Uncommon"],
-                        "Promotional&ndash;Ivory": ["Fixed", "Promo"],
-                    }
-                },
-                {
-                    "Onyx Edition": {
-                        "Hidden Forest War": ["Fixed"],
-                        "Onyx Edition": ["Fixed"],
-                        "Rise of Jigoku": ["Fixed"],
-                        "Road to Ruin": ["Fixed"],
-                        "Rise of Otosan Uchi": ["Fixed"],
-                        "Promotional&ndash;Onyx": ["Promo"],
-                    }
-                },
-                {
-                    "Shattered Empire": {
-                        "Gathering Storm": ["Fixed"],
-                        "Chaos Reigns I": ["Fixed"],
-                        "Promotional&ndash;Shattered Empire": ["Promo"],
-                    }
-                },
-                {
-                    "Special": {
-                        "Oracle of the Void": ["None"],
-                        "Cubic Zirconia Edition": ["Fixed"],
-                    }
-                },
-            ]
-        case _:
-            logger.error("Unknown lookup %s", query["lookup"])
-            return []
+    with stage("decode"):
+        if request.method == "POST":
+            query = get_attributes_query_params(await request.body())
+        else:
+            query = dict(request.query_params)
 
+    if (attribute := attributes_payloads.get(query["lookup"])) is None and (
+        attribute := FALLBACK_ATTRIBUTES.get(query["lookup"])
+    ) is None:
+        logger.error("Unknown lookup %s", query["lookup"])
+        return []
 
-class QueryParams(TypedDict):
+    payload, etag = attribute
+    return json_response(
+        request, payload, etag, {"Cache-Control": "public, max-age=3600"}
+    )
+
+
+class SearchPlan(TypedDict):
     querystring: str
-    table: str
-    sort: list[dict[str, dict[str, str]]]
-    size: str
-    from_: str
+    filters: list[str]
+    sort: list[dict[str, dict[str, str]]] | str
+    seed: int
+    size: int
+    from_: int
+    search_after: list[Any] | None
+    facets: list[str]
 
 
 class SearchQuery(TypedDict):
@@ -343,73 +374,354 @@ class SearchQuery(TypedDict):
     filter_by: str
     query_by: str
     sort_by: str
-    per_page: str
-    page: str
+    limit: int
+    offset: int
+    facet_by: str
+    max_facet_values: int
+
+
+# Card statistics -> their int32 companion fields in the collection schema
+NUMERIC_FIELDS = {
+    field: f"{field}_value"
+    for field in ("cost", "force", "chi", "focus", "ph", "honor", "production")
+}
+
+# Fields declared with facet: True in the ingestor's collection schema
+FACET_FIELDS = {"clan", "deck", "keywords", "legality", "type"} | set(
+    NUMERIC_FIELDS.values()
+)
+MAX_FACET_VALUES = 100
+
+# Fields of the collection schema that can be filtered on
+FILTER_FIELDS = FACET_FIELDS | {"cardid"}
+# Fields searched through q/query_by rather than filter_by
+QUERY_FIELDS = {"title", "formattedtitle"}
+
+DEFAULT_SORT = [{"title.keyword": {"order": "asc"}}]
+
+# Elasticsearch sort fields (without .keyword) -> sortable schema fields
+SORT_FIELDS = {
+    "title": "title_rank",
+    "formattedtitle": "title_rank",
+    "puretexttitle": "title_rank",
+    **{
+        field: f"{companion}(missing_values: last)"
+        for field, companion in NUMERIC_FIELDS.items()
+    },
+}
+MAX_SORT_FIELDS = 3
+# Sort fields set on every document, which keyset pagination can range over
+KEYSET_FIELDS = {"title_rank"}
+# Deepest from + size served without a search_after cursor
+MAX_OFFSET = 1000
+# Signs the cursors, shared by every API process serving the same clients
+CURSOR_KEY = secrets.token_bytes(32)
+
+
+def get_sort_by(sort: list[dict[str, Any]] | str, seed: int) -> str:
+    """Translate an Elasticsearch sort clause into Typesense sort_by
+
+    "random" is a seeded shuffle done by the engine, the same seed gives the
+    same order on every page. Bare field names sort ascending.
+    """
+    if sort == "random":
+        return f"_rand({seed})"
+
+    clauses: list[str] = []
+    for item in sort if isinstance(sort, list) else []:
+        if isinstance(item, str):
+            item = {item: "asc"}
+        elif not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail="Invalid sort")
+        for key, value in item.items():
+            order = value.get("order", "asc") if isinstance(value, dict) else value
+            if (field := SORT_FIELDS.get(key.removesuffix(".keyword"))) is None:
+                logger.debug("Field %s is not sortable", key)
+                continue
+            clauses.append(f"{field}:{'desc' if order == 'desc' else 'asc'}")
+
+    # Tie-break on the title rank, unique per card, so that pages don't overlap
+    if not any(x.startswith("title_rank:") for x in clauses):
+        clauses.append("title_rank:asc")
+
+    return ",".join(clauses[:MAX_SORT_FIELDS])
+
+
+def get_sort_fields(sort_by: str) -> list[str]:
+    """Document fields holding the sort values of sort_by"""
+    return [
+        re.split(r"[(:]", x.strip(), maxsplit=1)[0]
+        for x in sort_by.split(",")
+        if x.strip() and not x.strip().startswith("_rand")
+    ]
+
+
+def sign_cursor(payload: str) -> str:
+    return hmac.new(CURSOR_KEY, payload.encode("ascii"), "sha256").hexdigest()[:32]
+
+
+def encode_cursor(sort_values: list[Any], position: int) -> str:
+    """Opaque search_after cursor: the last hit's sort values and the next offset
+
+    Signed, since the offset is trusted when no keyset filter can be used.
+    """
+    payload = base64.urlsafe_b64encode(
+        json.dumps({"after": sort_values, "from": position}).encode("utf-8")
+    ).decode("ascii")
+    return f"{payload}.{sign_cursor(payload)}"
+
+
+def decode_cursor(cursor: str) -> dict[str, Any]:
+    payload, _, signature = cursor.partition(".")
+    try:
+        if not hmac.compare_digest(sign_cursor(payload), signature):
+            raise ValueError("Bad signature")
+        decoded = json.loads(base64.urlsafe_b64decode(payload.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError, TypeError) as error:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from error
+    if (
+        not isinstance(decoded, dict)
+        or not isinstance(decoded.get("after"), list)
+        or not isinstance(decoded.get("from"), int)
+        or decoded["from"] < 0
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return decoded
+
+
+def get_keyset_filter(sort_by: str, sort_values: list[Any]) -> str | None:
+    """filter_by selecting the documents sorted after sort_values
+
+    Only possible when every sort field is set on every document, documents
+    missing a value can't be selected by a range.
+    """
+    clauses = [x.strip().split(":") for x in sort_by.split(",") if x.strip()]
+    if (
+        len(clauses) != len(sort_values)
+        or any(len(x) != 2 or x[0] not in KEYSET_FIELDS for x in clauses)
+        or not all(isinstance(x, int) for x in sort_values)
+    ):
+        return None
+
+    alternatives = []
+    for position, (field, order) in enumerate(clauses):
+        alternatives.append(
+            " && ".join(
+                [
+                    *(
+                        f"{equal}:={value}"
+                        for (equal, _), value in zip(clauses, sort_values[:position])
+                    ),
+                    f"{field}:{'<' if order == 'desc' else '>'}{sort_values[position]}",
+                ]
+            )
+        )
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return " || ".join(f"({x})" for x in alternatives)
+
+
+def is_integer(value: str) -> bool:
+    return value.strip().lstrip("+-").isdigit()
+
+
+def quote(value: str) -> str:
+    """Backtick-quoted filter_by value, so that commas and spaces are kept"""
+    return f"`{value.replace('&nbsp;', ' ').replace('`', '')}`"
+
+
+def filter_select(field: str, values: list[str]) -> list[str]:
+    return [f"{field}:=[{','.join(quote(x) for x in values)}]"]
 
 
-FilterBy = dict[str, Any]
+def filter_match_and(field: str, values: list[str]) -> list[str]:
+    return [f"{field}:{quote(token)}" for x in values for token in x.split()]
 
 
-def get_query_params(params: dict[str, Any]) -> tuple[str, str]:
-    querystring = "*"
+def filter_match_or(field: str, values: list[str]) -> list[str]:
+    tokens = [quote(token) for x in values for token in x.split()]
+    return [f"{field}:[{','.join(tokens)}]"] if tokens else []
+
+
+def filter_match_phrase(field: str, values: list[str]) -> list[str]:
+    return [f"{field}:[{','.join(quote(x) for x in values)}]"]
+
+
+def filter_wildcard(field: str, values: list[str]) -> list[str]:
+    prefixes = [x.replace("&nbsp;", " ").strip("*").replace("`", "") for x in values]
+    prefixes = [x for x in prefixes if x]
+    return [f"{field}:[{','.join(f'{x}*' for x in prefixes)}]"] if prefixes else []
+
+
+def filter_exists(field: str, values: list[str]) -> list[str]:
+    if field in NUMERIC_FIELDS:
+        return [f"{NUMERIC_FIELDS[field]}:>={-(2**31)}"]
+    logger.debug("exists is only supported on numeric fields, not %s", field)
+    return []
+
+
+# type_xxx -> filter_by clauses for the values of field_xxx, see docs/API.md
+OPERATORS = {
+    "select": filter_select,
+    "regexp": filter_select,
+    "text": filter_match_and,
+    "match_and": filter_match_and,
+    "match_or": filter_match_or,
+    "match_phrase": filter_match_phrase,
+    "keyword": filter_match_phrase,
+    "wildcard": filter_wildcard,
+    "exists": filter_exists,
+}
+
+
+def parse_integer(params: dict[str, str | list[str]], name: str, default: int) -> int:
+    value = params.get(name, default)
+    if not isinstance(value, (str, int)) or not str(value).strip().isdigit():
+        raise HTTPException(status_code=400, detail=f"Invalid {name}")
+    return int(value)
+
+
+def get_search_plan(params: dict[str, str | list[str]]) -> SearchPlan:
+    """Turn the decoded field_xxx/type_xxx pairs into a query and filters"""
+    querystrings: list[str] = []
     filters: list[str] = []
+
+    if (querystring := str(params.get("querystring", "")).strip()) not in {"", "*"}:
+        querystrings.append(querystring)
+
     for key, value in params.items():
-        match key:
-            case "field_title" | "querystring":
-                querystring = value
-            case "field_keywords":
-                if isinstance(value, list):
-                    filters.extend([f"keywords:=[{x}]" for x in value])
-                else:
-                    filters.append(f"keywords:=[{value}]")
-            case "field_clan":
-                if isinstance(value, list):
-                    filters.extend([f"clan:=[{x}]" for x in value])
-                else:
-                    filters.append(f"clan:=[{value}]")
-            case "field_legality":
-                if isinstance(value, list):
-                    filters.extend(
-                        [f"legality:=[{x.replace('&nbsp;', ' ')}]" for x in value]
-                    )
-                else:
-                    filters.append(f"legality:=[{value.replace('&nbsp;', ' ')}]")
-
-    return querystring, " && ".join(filters)
-
-
-def get_search_params(body: bytes) -> SearchQuery:
+        if not key.startswith("field_"):
+            continue
+
+        name = key.removeprefix("field_")
+        values = [x for x in ([value] if isinstance(value, str) else value) if x]
+
+        if name.startswith(("lower_", "upper_")):
+            name = name.removeprefix("lower_").removeprefix("upper_")
+            if params.get(f"type_{name}") != "numeric":
+                continue
+            if name not in NUMERIC_FIELDS:
+                logger.debug("Field %s is not numeric", name)
+                continue
+            bound = ">=" if key.startswith("field_lower_") else "<="
+            filters.extend(
+                f"{NUMERIC_FIELDS[name]}:{bound}{int(x)}"
+                for x in values
+                if is_integer(x)
+            )
+            continue
+
+        operator = params.get(f"type_{name}", "select")
+        if not values:
+            continue
+        if name in QUERY_FIELDS and operator != "exists":
+            querystrings.extend(values)
+            continue
+        if name in NUMERIC_FIELDS and operator != "exists":
+            if numbers := [str(int(x)) for x in values if is_integer(x)]:
+                filters.append(f"{NUMERIC_FIELDS[name]}:=[{','.join(numbers)}]")
+            continue
+        if name not in FILTER_FIELDS and name not in NUMERIC_FIELDS:
+            logger.debug("Field %s is not indexed", name)
+            continue
+        if (operator_filter := OPERATORS.get(str(operator))) is None:
+            logger.warning("Unknown operator %s for field %s", operator, name)
+            continue
+
+        filters.extend(operator_filter(name, values))
+
+    sort = params.get("sort")
+    if isinstance(sort, list):
+        # Repeated sort parameters
+        raise HTTPException(status_code=400, detail="Invalid sort")
+    if not sort:
+        sort = DEFAULT_SORT
+    elif sort != "random":
+        try:
+            sort = json.loads(sort)
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail="Invalid sort") from error
+        # A single clause, as Elasticsearch accepts
+        if isinstance(sort, (str, dict)):
+            sort = [sort]
+        elif not isinstance(sort, list):
+            raise HTTPException(status_code=400, detail="Invalid sort")
+
+    querystring = " ".join(querystrings) or "*"
+    if str(seed := params.get("seed", "")).isdigit():
+        seed = int(seed)
+    else:
+        # Without an explicit seed, the same search always gets the same shuffle
+        seed = zlib.crc32(f"{querystring}|{'&&'.join(filters)}".encode("utf-8"))
+
+    return SearchPlan(
+        querystring=querystring,
+        filters=filters,
+        sort=sort,
+        seed=seed,
+        size=parse_integer(params, "size", 50),
+        from_=parse_integer(params, "from", 0),
+        search_after=(
+            decode_cursor(cursor)
+            if isinstance(cursor := params.get("search_after"), str) and cursor
+            else None
+        ),
+        facets=[
+            x for x in str(params.get("facets", "")).split(",") if x in FACET_FIELDS
+        ],
+    )
+
+
+def get_search_params(body: bytes) -> tuple[SearchQuery, int]:
     """b'querystring=hitomi&table=l5r&sort=%5B%7B%22title.keyword%22%3A%7B%22order%22%3A%22asc%22%7D%7D%5D&size=50&from=0'
+    b'querystring=*&facets=clan%2Ctype&table=l5r&size=50&from=0'
     b'type_printing_set=select&field_printing_set=Chaos%20Reigns%20I&table=l5r&sort=%5B%7B%22title.keyword%22%3A%7B%22order%22%3A%22desc%22%7D%7D%5D&size=50&from=0'
     {'type_title': 'text', 'field_title': 'Gusai ', 'table': 'l5r', 'sort': [{'title.keyword': {'order': 'asc'}}], 'size': '50', 'from': '0'}
+
+    Also returns the position of the first hit among all the results.
     """
-    decoded_params = {}
-    decoded_body = body.decode("utf-8")
-    for param in decoded_body.split("&"):
-        key, value = param.split("=")
-        decoded_params[key] = urllib.parse.unquote(value)
-        if key == "sort":
-            decoded_params[key] = json.loads(decoded_params[key])
+    plan = get_search_plan(decode_body(body))
+    logger.debug("Search plan %s", plan)
 
-    logger.info(decoded_params)
+    sort_by = get_sort_by(plan["sort"], plan["seed"])
+    filters = plan["filters"]
+    position = plan["from_"]
+    offset = plan["from_"]
+    keyset = None
 
-    querystring, filters = get_query_params(decoded_params)
+    if (cursor := plan["search_after"]) is not None:
+        position = offset = cursor["from"]
+        if keyset := get_keyset_filter(sort_by, cursor["after"]):
+            # Seek past the previous page instead of skipping every hit before it
+            filters = [*filters, f"({keyset})"] if filters else [keyset]
+            offset = 0
+    if offset + plan["size"] > MAX_OFFSET:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Pages past {MAX_OFFSET} results need a search_after cursor "
+            "and a sort on the title",
+        )
 
     search_query = SearchQuery(
-        q=querystring,
-        filter_by=filters,
+        q=plan["querystring"],
+        filter_by=" && ".join(filters),
         query_by="formattedtitle",
-        sort_by="formattedtitle:asc",
-        limit=decoded_params["size"],
-        offset=decoded_params["from"],
+        sort_by=sort_by,
+        limit=plan["size"],
+        offset=offset,
     )
 
-    logger.info(search_query)
+    # Facets of the hits after a keyset would undercount, the first page has them
+    if plan["facets"] and keyset is None:
+        search_query["facet_by"] = ",".join(plan["facets"])
+        search_query["max_facet_values"] = MAX_FACET_VALUES
 
-    return search_query
+    logger.debug("Search query %s", search_query)
 
+    return search_query, position
 
-def convert(hit: dict) -> dict:
+
+def convert(hit: dict, sort_fields: Iterable[str] = ("title_rank",)) -> dict:
     return {
         "_index": "l5r",
         "_type": "oracle-l5r_type",
@@ -417,73 +729,353 @@ def convert(hit: dict) -> dict:
         "_score": None,
         "_ignored": ["honor"],
         "_source": hit["document"],
-        "sort": [hit["document"]["formattedtitle"]],
+        "sort": [hit["document"].get(x) for x in sort_fields],
     }
 
 
-@app.get("/oracle-fetch")
-async def oracle_fetch(table: str, cardid: str):
-    search_query = {
-        "q": cardid,
-        "query_by": "cardid",
-        "sort_by": "formattedtitle:asc",
+def source_bytes(document: dict) -> bytes:
+    """JSON of a card, serialized once and then reused by every response"""
+    if (source := source_cache.get(document["cardid"])) is None:
+        source = orjson.dumps(document)
+        source_cache.set(document["cardid"], source)
+    return source
+
+
+def render_hit(document: dict, sort_values: list[Any]) -> bytes:
+    """convert() serialized around the cached bytes of the card"""
+    return b"".join(
+        (
+            b'{"_index":"l5r","_type":"oracle-l5r_type","_id":',
+            orjson.dumps(f"cardid={document['cardid']}.0"),
+            b',"_score":null,"_ignored":["honor"],"_source":',
+            source_bytes(document),
+            b',"sort":',
+            orjson.dumps(sort_values),
+            b"}",
+        )
+    )
+
+
+def render_search(total: int, hits: list[bytes], **extra: Any) -> bytes:
+    """Elasticsearch-shaped /search response around already serialized hits"""
+    return b"".join(
+        (
+            b'{"took":1,"timed_out":false,'
+            b'"_shards":{"total":1,"successful":1,"skipped":0,"failed":0},'
+            b'"hits":{"total":',
+            str(total).encode("ascii"),
+            b',"max_score":null,"hits":[',
+            b",".join(hits),
+            b"]}",
+            *(
+                b"," + orjson.dumps(key) + b":" + orjson.dumps(value)
+                for key, value in extra.items()
+            ),
+            b"}",
+        )
+    )
+
+
+def cards_etag(hashes: list[str]) -> str:
+    """Strong ETag from the content hashes the ingestor computed for the cards"""
+    if len(hashes) == 1:
+        return hashes[0]
+    return hashlib.sha1(",".join(hashes).encode("ascii")).hexdigest()
+
+
+async def fetch_sources(cardids: list[str]) -> dict[str, tuple[bytes, str]]:
+    """cardid -> JSON bytes and content hash, from the snapshot if one is loaded"""
+    if snapshot is not None:
+        with stage("engine"):
+            return {x: entry for x in cardids if (entry := snapshot.get(x))}
+
+    cards = await fetch_cards(cardids)
+    return {
+        cardid: (source := source_bytes(card), document_hash(card, source))
+        for cardid, card in cards.items()
+    }
+
+
+def document_hash(card: dict, source: bytes) -> str:
+    """Hash of the bytes served for a card, strong ETags are built from it
+
+    The title rank is set after the ingestor hashed the card, and changes when
+    cards are added or removed before it, so it is hashed along.
+    """
+    if (content_hash := card.get("content_hash")) is None:
+        return hashlib.sha1(source).hexdigest()
+    return hashlib.sha1(
+        f"{content_hash}:{card.get('title_rank')}".encode("ascii")
+    ).hexdigest()
+
+
+def convert_facets(facet_counts: list[dict]) -> dict:
+    """Typesense facet_counts as Elasticsearch terms aggregations"""
+    return {
+        facet["field_name"]: {
+            "doc_count_error_upper_bound": 0,
+            "sum_other_doc_count": 0,
+            "buckets": [
+                {"key": count["value"], "doc_count": count["count"]}
+                for count in facet["counts"]
+            ],
+        }
+        for facet in facet_counts
     }
 
-    search_results = collection.documents.search(search_query)
 
-    logger.info(search_results)
-    if not (found_elements := search_results["found"]):
-        return {}
+@app.get("/oracle-fetch")
+async def oracle_fetch(request: Request, table: str, cardid: str):
+    """Single cardid returns the card, comma-separated cardids an array of cards"""
+    cardids = list(dict.fromkeys(x for x in cardid.split(",") if x))
+
+    sources = await fetch_sources(cardids)
+    found = [sources[x] for x in cardids if x in sources]
+    if not found:
+        raise HTTPException(status_code=404, detail="Cards not found")
+
+    if missing := [x for x in cardids if x not in sources]:
+        logger.warning("Cards not found: %s", missing)
 
-    hits = search_results["hits"]
+    etag = cards_etag([content_hash for _, content_hash in found])
+    # Cards only change with an ingest, revalidating is enough
+    headers = {"Cache-Control": "no-cache"}
 
-    return convert(hits[0])["_source"]
+    with stage("serialize"):
+        if "," not in cardid:
+            body = found[0][0]
+        else:
+            body = b"[" + b",".join(source for source, _ in found) + b"]"
+
+    return json_response(request, body, etag, headers)
 
 
 @app.post("/search")
 async def search(request: Request):
-    search_query = get_search_params(await request.body())
+    with stage("decode"):
+        search_query, position = get_search_params(await request.body())
+        cache_key = json.dumps([search_query, position], sort_keys=True)
+
+    if (variants := search_cache.get(cache_key)) is not None:
+        return json_response(request, variants)
+
+    with stage("engine"):
+        try:
+            search_results = await engine.search(COLLECTION, search_query)
+        except typesense.exceptions.RequestMalformed as error:
+            # The query is built from the request, the engine rejecting it is a 400
+            raise HTTPException(status_code=400, detail=str(error)) from error
 
-    search_results = collection.documents.search(search_query)
+    logger.debug("Search results %s", search_results)
+    with stage("transform"):
+        # With a keyset filter, found only counts the hits after the cursor
+        found_elements = search_results["found"] + position - search_query["offset"]
+        hits = search_results["hits"]
+        sort_fields = get_sort_fields(search_query["sort_by"])
+        sort_values = [[x["document"].get(y) for y in sort_fields] for x in hits]
+
+        extra: dict[str, Any] = {
+            "search_after": (
+                encode_cursor(sort_values[-1], position + len(hits))
+                if hits and position + len(hits) < found_elements
+                else None
+            ),
+        }
+        if "facet_counts" in search_results and "facet_by" in search_query:
+            extra["aggregations"] = convert_facets(search_results["facet_counts"])
+
+    with stage("serialize"):
+        content = render_search(
+            found_elements,
+            [render_hit(x["document"], y) for x, y in zip(hits, sort_values)],
+            **extra,
+        )
+    # Compressed variants are added to the cached entry as they get requested
+    variants = {"identity": content}
+    search_cache.set(cache_key, variants)
+
+    return json_response(request, variants)
+
+
+# Bearer token of /cache/invalidate, only loopback clients may call it without
+INVALIDATE_TOKEN: str | None = None
+LOOPBACK_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+
+def is_invalidation_allowed(request: Request) -> bool:
+    if INVALIDATE_TOKEN is None:
+        return request.client is not None and request.client.host in LOOPBACK_HOSTS
+    return hmac.compare_digest(
+        request.headers.get("authorization", "").encode("utf-8"),
+        f"Bearer {INVALIDATE_TOKEN}".encode("utf-8"),
+    )
+
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(request: Request):
+    """Called by the ingestor once it published a new collection version"""
+    if not is_invalidation_allowed(request):
+        raise HTTPException(status_code=403, detail="Not allowed to invalidate")
+    card_cache.invalidate()
+    search_cache.invalidate()
+    source_cache.invalidate()
+    await load_attributes()
+    if snapshot is not None:
+        load_snapshot(snapshot.path)
+    logger.info("Caches invalidated")
+    return await cache_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return metrics.render(
+        {"cards": card_cache, "search": search_cache, "sources": source_cache}
+    )
 
-    logger.info(search_results)
-    found_elements = search_results["found"]
-    hits = search_results["hits"]
 
+@app.get("/cache/stats")
+async def cache_stats():
     return {
-        "took": 1,
-        "timed_out": False,
-        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
-        "hits": {
-            "total": found_elements,
-            "max_score": None,
-            "hits": [convert(x) for x in hits],
-        },
+        "cards": card_cache.stats(),
+        "search": search_cache.stats(),
+        "sources": source_cache.stats(),
     }
 
 
-typesense_client: typesense.Client
-collection: typesense.collection.Collection
+COLLECTION = "l5r"
+
+engine: TypesenseEngine | EmbeddedEngine
+# Cards written by the ingestor --snapshot, served by /oracle-fetch when set
+snapshot: Snapshot | None = None
+
+
+def load_snapshot(path: Path) -> None:
+    """Map the snapshot, the ingestor replaces the file on each run"""
+    global snapshot
+    previous, snapshot = snapshot, Snapshot(path)
+    if previous is not None:
+        previous.close()
+    logger.info(
+        "Snapshot %s mapped: %s cards, version %s",
+        path,
+        len(snapshot),
+        snapshot.meta["version"],
+    )
+
+
+@app.on_event("startup")
+async def startup():
+    logger.info(await engine.retrieve(COLLECTION))
+    await load_attributes()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await engine.close()
 
 
 def main():
+    global engine, MAX_OFFSET, CURSOR_KEY, INVALIDATE_TOKEN
+
+    parser = argparse.ArgumentParser(description="Run the Oracle search API")
+    parser.add_argument(
+        "--engine",
+        choices=["typesense", "embedded"],
+        default="typesense",
+        help="Search in a Typesense server, or in memory without any server",
+    )
+    parser.add_argument(
+        "--database",
+        type=Path,
+        help="Oracle XML database indexed by the embedded engine",
+    )
+    parser.add_argument(
+        "--snapshot",
+        type=Path,
+        help="Card snapshot written by the ingestor, to serve /oracle-fetch from",
+    )
+    parser.add_argument("--typesense-host", default="localhost")
+    parser.add_argument("--typesense-port", type=int, default=8108)
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=20,
+        help="Maximum number of keep-alive connections to Typesense",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=2.0,
+        help="Timeout in seconds of the requests to Typesense",
+    )
+    parser.add_argument(
+        "--max-offset",
+        type=int,
+        default=MAX_OFFSET,
+        help="Deepest from + size served without a search_after cursor",
+    )
+    parser.add_argument(
+        "--cursor-key",
+        help="Secret signing the search_after cursors, to share between API "
+        "processes. Random by default: cursors don't survive a restart",
+    )
+    parser.add_argument(
+        "--invalidate-token",
+        default=os.environ.get("OOTV_INVALIDATE_TOKEN"),
+        help="Secret the ingestor sends to /cache/invalidate, which only accepts "
+        "loopback clients without it (default: $OOTV_INVALIDATE_TOKEN)",
+    )
+    parser.add_argument(
+        "--card-cache-size",
+        type=int,
+        default=card_cache.maxsize,
+        help="Maximum number of cards kept in memory",
+    )
+    parser.add_argument(
+        "--search-cache-size",
+        type=int,
+        default=search_cache.maxsize,
+        help="Maximum number of search responses kept in memory",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=search_cache.ttl,
+        help="Time in seconds after which cached entries are refetched",
+    )
+
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.INFO)
 
     import uvicorn
 
-    global typesense_client, collection
+    if args.engine == "embedded":
+        if args.database is None:
+            parser.error("--database is required by the embedded engine")
+        engine = EmbeddedEngine.from_xml(args.database, COLLECTION)
+    else:
+        engine = TypesenseEngine(
+            host=args.typesense_host,
+            port=args.typesense_port,
+            api_key="xyz",
+            pool_size=args.pool_size,
+            timeout=args.timeout,
+        )
+        logger.info("Connected to Typesense")
 
-    typesense_client = typesense.Client(
-        {
-            "api_key": "xyz",
-            "nodes": [
-                {"host": "localhost", "port": "8108", "protocol": "http"},
-            ],
-        }
-    )
-    logger.info("Connected to Typesense")
+    if args.snapshot is not None:
+        load_snapshot(args.snapshot)
 
-    collection = typesense_client.collections["l5r"]
-    logger.info(collection.retrieve())
+    MAX_OFFSET = args.max_offset
+    INVALIDATE_TOKEN = args.invalidate_token
+    if args.cursor_key is not None:
+        CURSOR_KEY = args.cursor_key.encode("utf-8")
+    card_cache.maxsize = args.card_cache_size
+    source_cache.maxsize = args.card_cache_size
+    source_cache.ttl = args.cache_ttl
+    card_cache.ttl = args.cache_ttl
+    search_cache.maxsize = args.search_cache_size
+    search_cache.ttl = args.cache_ttl
 
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -79,3 +79,30 @@ LEGALITY_MAPPING = {
     "onyx": "Onyx",
     "shattered_empire": "Shattered Empire",
 }
+
+# Set -> arc, to group the sets in the frontend pull-downs
+SET_ARCS = {
+    "Twenty Festivals": "A Brother's Destiny (Ivory)",
+    "Thunderous Acclaim": "A Brother's Destiny (Ivory)",
+    "Siege: Clan War": "A Brother's Destiny (Ivory)",
+    "Evil Portents": "A Brother's Destiny (Ivory)",
+    "The Blackest Storm": "A Brother's Destiny (Ivory)",
+    "Hidden Forest War": "Onyx Edition",
+    "Onyx Edition": "Onyx Edition",
+    "Rise of Jigoku": "Onyx Edition",
+    "Road to Ruin": "Onyx Edition",
+    "Rise of Otosan Uchi": "Onyx Edition",
+    "Gathering Storm": "Shattered Empire",
+    "Chaos Reigns I": "Shattered Empire",
+}
+OTHER_ARC = "Other"
+
+
+def group_by_arc(set_rarities: dict[str, list[str]]) -> list[dict]:
+    """printing.set:printing.rarity lookup, one option group per arc"""
+    arcs: dict[str, dict[str, list[str]]] = {
+        x: {} for x in (*dict.fromkeys(SET_ARCS.values()), OTHER_ARC)
+    }
+    for set_, rarities in set_rarities.items():
+        arcs[SET_ARCS.get(set_, OTHER_ARC)][set_] = rarities
+    return [{arc: sets} for arc, sets in arcs.items() if sets]
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import bisect
+import contextlib
+import contextvars
+import time
+from collections import defaultdict
+from typing import Iterator
+
+from .cache import LRUCache
+
+# Seconds, from sub-millisecond cache hits up to Typesense timeouts
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    labels = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return f"{{{labels}}}" if labels else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple[str, ...], float] = defaultdict(float)
+        METRICS.append(self)
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] += amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> per bucket counts (the last one is +Inf), sum
+        self.values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        METRICS.append(self)
+
+    def observe(self, value: float, *labels: str) -> None:
+        if (counts := self.values.get(labels)) is None:
+            counts = self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts[0][bisect.bisect_left(self.buckets, value)] += 1
+        counts[1][0] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket_labels = format_labels(
+                    (*self.labels, "le"), (*labels, str(bound))
+                )
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {total[0]}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}"
+
+
+METRICS: list[Counter | Histogram] = []
+
+REQUESTS = Counter(
+    "oracle_requests_total", "Requests by route and status", ("route", "status")
+)
+REQUEST_LATENCY = Histogram(
+    "oracle_request_duration_seconds", "Request latency by route", ("route",)
+)
+STAGE_LATENCY = Histogram(
+    "oracle_stage_duration_seconds",
+    "Time spent in each stage of a request",
+    ("route", "stage"),
+)
+ENGINE_ERRORS = Counter(
+    "oracle_engine_errors_total", "Failed Typesense requests by error", ("error",)
+)
+
+# Stage -> seconds of the request being handled, None outside of a request
+timings: contextvars.ContextVar[dict[str, float] | None] = contextvars.ContextVar(
+    "timings", default=None
+)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage of the current request, for the histograms and Server-Timing"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if (current := timings.get()) is not None:
+            current[name] = current.get(name, 0.0) + time.perf_counter() - start
+
+
+def server_timing(current: dict[str, float], total: float) -> str:
+    """Server-Timing header value, durations in milliseconds"""
+    return ", ".join(
+        f"{name};dur={seconds * 1000:.2f}"
+        for name, seconds in (*current.items(), ("total", total))
+    )
+
+
+def render_caches(caches: dict[str, LRUCache]) -> Iterator[str]:
+    for name, kind, help in (
+        ("oracle_cache_hits_total", "counter", "Cache lookups that found an entry"),
+        ("oracle_cache_misses_total", "counter", "Cache lookups without an entry"),
+        ("oracle_cache_hit_ratio", "gauge", "Hits over lookups since startup"),
+        ("oracle_cache_entries", "gauge", "Entries currently cached"),
+    ):
+        yield f"# HELP {name} {help}"
+        yield f"# TYPE {name} {kind}"
+        for cache_name, cache in caches.items():
+            lookups = cache.hits + cache.misses
+            value = {
+                "oracle_cache_hits_total": cache.hits,
+                "oracle_cache_misses_total": cache.misses,
+                "oracle_cache_hit_ratio": cache.hits / lookups if lookups else 0.0,
+                "oracle_cache_entries": len(cache),
+            }[name]
+            yield f'{name}{{cache="{cache_name}"}} {value}'
+
+
+def render(caches: dict[str, LRUCache]) -> str:
+    """Prometheus text exposition format"""
+    lines = [line for metric in METRICS for line in metric.render()]
+    lines.extend(render_caches(caches))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+MANIFEST = "manifest.json"
+# Columns of the index shard, enough to list and filter cards client-side
+INDEX_COLUMNS = ("cardid", "title", "type", "clan", "cost")
+SLUG_PATTERN = re.compile(r"[^a-z0-9]+")
+
+
+def slug(name: str) -> str:
+    return SLUG_PATTERN.sub("-", name.lower()).strip("-")
+
+
+class ShardWriter:
+    """Static JSON shards of the cards, for a CDN in front of the frontend
+
+    One shard per deck, one per set and a columnar index shard. The files
+    are gzipped and named after their content hash, so they can be cached
+    forever: only manifest.json, mapping shard names to files, changes.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        # Shard name -> JSON of its cards, each card serialized only once
+        self.shards: dict[str, list[bytes]] = defaultdict(list)
+        self.index: dict[str, list[Any]] = {x: [] for x in INDEX_COLUMNS}
+
+    def add(self, card_dict: dict) -> None:
+        data = json.dumps(card_dict, separators=(",", ":"), ensure_ascii=False).encode(
+            "utf-8"
+        )
+
+        for deck in card_dict.get("deck", []):
+            self.shards[f"deck-{slug(deck)}"].append(data)
+        for set_ in dict.fromkeys(
+            x for printing in card_dict["printing"] for x in printing["set"]
+        ):
+            self.shards[f"set-{slug(set_)}"].append(data)
+
+        self.index["cardid"].append(card_dict["cardid"])
+        self.index["title"].append(card_dict["formattedtitle"])
+        self.index["type"].append(card_dict["type"][0])
+        self.index["clan"].append(card_dict.get("clan", []))
+        self.index["cost"].append(card_dict.get("cost_value"))
+
+    def write_shard(self, name: str, data: bytes) -> dict[str, Any]:
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        path = self.directory / f"{name}.{digest}.json.gz"
+        if not path.exists():
+            # mtime=0 so that the same content always gives the same bytes
+            path.write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+        return {
+            "file": path.name,
+            "bytes": path.stat().st_size,
+            "raw_bytes": len(data),
+        }
+
+    def write(self, version: str) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.directory / MANIFEST
+        previous = (
+            json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+        )
+
+        shards = {
+            name: {
+                **self.write_shard(name, b"[" + b",".join(cards) + b"]"),
+                "count": len(cards),
+            }
+            for name, cards in sorted(self.shards.items())
+        }
+        shards["index"] = {
+            **self.write_shard(
+                "index",
+                json.dumps(
+                    self.index, separators=(",", ":"), ensure_ascii=False
+                ).encode("utf-8"),
+            ),
+            "count": len(self.index["cardid"]),
+        }
+
+        manifest = {"version": version, "encoding": "gzip", "shards": shards}
+        temporary = manifest_path.with_name(f"{MANIFEST}.tmp")
+        temporary.write_text(json.dumps(manifest, indent=2))
+        temporary.replace(manifest_path)
+
+        # Clients holding the previous manifest can still fetch its shards
+        kept = {x["file"] for x in shards.values()} | {
+            x["file"] for x in previous.get("shards", {}).values()
+        }
+        for path in self.directory.glob("*.json.gz"):
+            if path.name not in kept:
+                path.unlink()
+
+        logger.info(
+            "%s shards written to %s, %s bytes gzipped",
+            len(shards),
+            self.directory,
+            sum(x["bytes"] for x in shards.values()),
+        )
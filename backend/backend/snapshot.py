@@ -0,0 +1,203 @@
+"""
+Snapshot of the converted cards, written by the ingestor and memory-mapped by
+the API to serve cards without the search server.
+
+    header  magic, format, count, slots, metadata length, table and metadata offsets
+    data    the JSON documents, one after the other
+    keys    the cardids, one after the other
+    table   open addressing hash table of slots, cardid -> document
+    meta    JSON metadata: version (collection name), creation time, count
+
+A slot is the hash of the cardid, the offset and length of the cardid and of
+the document, and the SHA-1 of the document as the ingestor computed it.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b"OOTVSNAP"
+FORMAT = 1
+HEADER = struct.Struct("<8sIIIIQQ")
+SLOT = struct.Struct("<QQIQI20s")
+
+
+def key_hash(key: bytes) -> int:
+    """Stable across processes, unlike hash()"""
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class SnapshotWriter:
+    """Stream documents to a snapshot, published atomically by commit()"""
+
+    def __init__(self, path: Path, version: str) -> None:
+        self.path = path
+        self.version = version
+        self.temporary = path.with_name(f"{path.name}.tmp")
+        self.file = self.temporary.open("wb")
+        self.file.write(bytes(HEADER.size))
+        self.offset = HEADER.size
+        # cardid -> document offset, length, digest
+        self.entries: dict[bytes, tuple[int, int, bytes]] = {}
+
+    def add(self, document: dict) -> None:
+        data = json.dumps(document, separators=(",", ":"), ensure_ascii=False).encode(
+            "utf-8"
+        )
+        if content_hash := document.get("content_hash"):
+            digest = bytes.fromhex(content_hash)
+        else:
+            digest = hashlib.sha1(data).digest()
+
+        self.file.write(data)
+        self.entries[document["cardid"].encode("utf-8")] = (
+            self.offset,
+            len(data),
+            digest,
+        )
+        self.offset += len(data)
+
+    def commit(self) -> None:
+        key_offsets = {}
+        for key in self.entries:
+            key_offsets[key] = self.offset
+            self.file.write(key)
+            self.offset += len(key)
+
+        # Power of two, at most half full so that probes stay short
+        slots = 8
+        while slots < len(self.entries) * 2:
+            slots *= 2
+        table = bytearray(slots * SLOT.size)
+        for key, (offset, length, digest) in self.entries.items():
+            position = key_hash(key) & (slots - 1)
+            while SLOT.unpack_from(table, position * SLOT.size)[2]:
+                position = (position + 1) & (slots - 1)
+            SLOT.pack_into(
+                table,
+                position * SLOT.size,
+                key_hash(key),
+                key_offsets[key],
+                len(key),
+                offset,
+                length,
+                digest,
+            )
+
+        table_offset = self.offset
+        self.file.write(table)
+        meta = json.dumps(
+            {
+                "version": self.version,
+                "created": int(time.time()),
+                "count": len(self.entries),
+            }
+        ).encode("utf-8")
+        self.file.write(meta)
+
+        self.file.seek(0)
+        self.file.write(
+            HEADER.pack(
+                MAGIC,
+                FORMAT,
+                len(self.entries),
+                slots,
+                len(meta),
+                table_offset,
+                table_offset + len(table),
+            )
+        )
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.temporary, self.path)
+        logger.info(
+            "Snapshot %s written with %s cards, %s bytes",
+            self.path,
+            len(self.entries),
+            table_offset + len(table) + len(meta),
+        )
+
+    def abort(self) -> None:
+        self.file.close()
+        self.temporary.unlink(missing_ok=True)
+
+
+class Snapshot:
+    """Memory-mapped snapshot, documents are only read when looked up"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with path.open("rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic,
+            format_,
+            self.count,
+            self.slots,
+            meta_length,
+            self.table_offset,
+            meta_offset,
+        ) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or format_ != FORMAT:
+            self.map.close()
+            raise ValueError(f"{path} is not a format {FORMAT} card snapshot")
+        self.meta = json.loads(self.map[meta_offset : meta_offset + meta_length])
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, cardid: str) -> bool:
+        return self.find(cardid) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for position in range(self.slots):
+            _, key_offset, key_length, *_ = SLOT.unpack_from(
+                self.map, self.table_offset + position * SLOT.size
+            )
+            if key_length:
+                yield self.map[key_offset : key_offset + key_length].decode("utf-8")
+
+    def find(self, cardid: str) -> tuple[int, int, bytes] | None:
+        key = cardid.encode("utf-8")
+        hashed = key_hash(key)
+        position = hashed & (self.slots - 1)
+        while True:
+            slot_hash, key_offset, key_length, offset, length, digest = (
+                SLOT.unpack_from(self.map, self.table_offset + position * SLOT.size)
+            )
+            if not key_length:
+                return None
+            if (
+                slot_hash == hashed
+                and self.map[key_offset : key_offset + key_length] == key
+            ):
+                return offset, length, digest
+            position = (position + 1) & (self.slots - 1)
+
+    def get(self, cardid: str) -> tuple[bytes, str] | None:
+        """JSON bytes of the card and its content hash"""
+        if (entry := self.find(cardid)) is None:
+            return None
+        offset, length, digest = entry
+        return self.map[offset : offset + length], digest.hex()
+
+    def document(self, cardid: str) -> dict | None:
+        if (entry := self.get(cardid)) is None:
+            return None
+        return json.loads(entry[0])
+
+    def close(self) -> None:
+        self.map.close()
@@ -0,0 +1,116 @@
+"""Per-card cost of ingestor.convert_text, before and after precompiling it
+
+    python benchmarks/convert_text.py path/to/oracle.xml
+
+The previous implementation is kept below as the reference, both are run over
+every card text of the database and must return the same results.
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import time
+from pathlib import Path
+
+from backend import ingestor
+from backend.keywords import KEYWORDS
+from backend.mappings import TYPE_MAPPING
+
+TOKEN_REPLACEMENTS = [
+    ("[BOW]", ":bow:"),
+    ("[FAVOR]", ":favor:"),
+]
+PAY_PATTERN = re.compile(r"\[PAY ([\d*]+)\]")
+
+KEPT = set()
+
+
+def convert_text_reference(text: str, card_type: str) -> tuple[str, list[str]]:
+    global KEPT
+
+    if card_type in {"Holding", "Item", "Personality", "Sensei", "Strategy"}:
+        parts = text.split("<br>", maxsplit=1)
+        if len(parts) == 2:
+            keywords_, text = parts
+        else:
+            if card_type in {"Personality", "Sensei"}:
+                keywords_ = parts[0]
+                text = ""
+            else:
+                text = parts[0]
+                keywords_ = ""
+        keywords = keywords_.split("&#8226;")
+
+    else:
+        keywords = []
+
+    cleaned_keywords: list[str] = []
+    for keyword in keywords:
+        # Remove HTML tags
+        keyword = re.sub(r"<[^>]+>", "", keyword)
+        keyword = keyword.strip()
+        if keyword:
+            cleaned_keywords.append(keyword)
+
+    if card_type in {"Holding", "Strategy", "Item"}:
+        if not any(
+            x in cleaned_keywords
+            for x in KEYWORDS.get(card_type, set()) | KEYWORDS["Generic"]
+        ):
+            text = keywords_ + "<br>" + text
+            cleaned_keywords = []
+        if card_type == "Item":
+            KEPT |= set(cleaned_keywords)
+
+    for token, replacement in TOKEN_REPLACEMENTS:
+        text = text.replace(token, replacement)
+
+    if "[PAY " in text:
+        text = PAY_PATTERN.sub(r":g\1:", text)
+
+    text = text.strip().removeprefix("<br>").strip()
+
+    return text, cleaned_keywords
+
+
+def load_texts(database: Path) -> list[tuple[str, str]]:
+    return [
+        (card.find("text").text or "", TYPE_MAPPING[card.attrib["type"]])
+        for card in ingestor.iter_cards(database)
+        if card.find("text") is not None
+    ]
+
+
+def per_card(function, texts: list[tuple[str, str]], rounds: int) -> float:
+    """Best of rounds, in microseconds per card"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for text, card_type in texts:
+            function(text, card_type)
+        best = min(best, time.perf_counter() - start)
+    return best / len(texts) * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database", type=Path, help="Oracle XML database")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    texts = load_texts(args.database)
+    for text, card_type in texts:
+        expected = convert_text_reference(text, card_type)
+        if (result := ingestor.convert_text(text, card_type)) != expected:
+            raise AssertionError(f"{card_type} {text!r}: {result} != {expected}")
+
+    before = per_card(convert_text_reference, texts, args.rounds)
+    after = per_card(ingestor.convert_text, texts, args.rounds)
+    print(f"{len(texts)} cards")
+    print(f"before: {before:.2f}us per card")
+    print(f"after:  {after:.2f}us per card ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
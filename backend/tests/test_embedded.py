@@ -0,0 +1,80 @@
+import pytest
+import typesense.exceptions
+
+from backend import main
+from backend.embedded import Index, split_filter
+
+DOCUMENTS = [
+    {"cardid": "A", "clan": ["Crab, Lion"], "type": ["Personality"], "title_rank": 0},
+    {"cardid": "B", "clan": ["Crab"], "type": ["Holding"], "title_rank": 1},
+    {"cardid": "C", "clan": ["Lion"], "type": ["Personality"], "title_rank": 2},
+    {"cardid": "D", "clan": ["Phoenix"], "type": ["Holding"], "title_rank": 3},
+]
+
+
+@pytest.fixture
+def index() -> Index:
+    return Index(DOCUMENTS)
+
+
+def cardids(index: Index, filter_by: str) -> set[str]:
+    return {index.documents[x]["cardid"] for x in index.filter(filter_by)}
+
+
+def test_split_filter_keeps_quoted_values_and_lists_whole():
+    assert split_filter("a:=[`x && y`,b] && (c:>1 || (d:=`(e)`))") == [
+        "a:=[`x && y`,b]",
+        "&&",
+        "(",
+        "c:>1",
+        "||",
+        "(",
+        "d:=`(e)`",
+        ")",
+        ")",
+    ]
+
+
+def test_and_binds_tighter_than_or(index):
+    assert cardids(index, "clan:=Phoenix || type:=Personality && title_rank:>0") == {
+        "C",
+        "D",
+    }
+
+
+def test_parentheses_group_clauses(index):
+    assert cardids(index, "(clan:=Phoenix || type:=Personality) && title_rank:>0") == {
+        "C",
+        "D",
+    }
+    assert cardids(index, "(clan:=Phoenix || type:=Personality) && title_rank:<3") == {
+        "A",
+        "C",
+    }
+
+
+def test_range_and_exclusion(index):
+    assert cardids(index, "title_rank:=[1..2]") == {"B", "C"}
+    assert cardids(index, "type:!=Holding") == {"A", "C"}
+
+
+@pytest.mark.parametrize("filter_by", ["(clan:=Crab", "clan:=Crab)", "clan"])
+def test_malformed_filters_are_rejected(index, filter_by):
+    with pytest.raises(typesense.exceptions.RequestMalformed):
+        index.filter(filter_by)
+
+
+def test_search_plan_quotes_values_with_commas(index):
+    plan = main.get_search_plan(
+        {"field_clan": ["Crab, Lion", "Phoenix"], "type_clan": "select"}
+    )
+    assert plan["filters"] == ["clan:=[`Crab, Lion`,`Phoenix`]"]
+    assert cardids(index, " && ".join(plan["filters"])) == {"A", "D"}
+
+
+def test_search_plan_with_keyset_filter(index):
+    plan = main.get_search_plan({"field_type": "Personality", "type_type": "select"})
+    keyset = main.get_keyset_filter("title_rank:asc", [0])
+    filter_by = " && ".join([*plan["filters"], f"({keyset})"])
+    assert cardids(index, " && ".join(plan["filters"])) == {"A", "C"}
+    assert cardids(index, filter_by) == {"C"}
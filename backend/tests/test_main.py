@@ -0,0 +1,43 @@
+import pytest
+from fastapi import HTTPException
+
+from backend import main
+
+
+@pytest.mark.parametrize(
+    "sort, sort_by",
+    [
+        ('[{"title.keyword": {"order": "desc"}}]', "title_rank:desc"),
+        ('["title.keyword"]', "title_rank:asc"),
+        ('"cost"', "cost_value(missing_values: last):asc,title_rank:asc"),
+        ('{"cost": "desc"}', "cost_value(missing_values: last):desc,title_rank:asc"),
+        ("", "title_rank:asc"),
+    ],
+)
+def test_sort_clauses(sort, sort_by):
+    plan = main.get_search_plan({"sort": sort})
+    assert main.get_sort_by(plan["sort"], plan["seed"]) == sort_by
+
+
+@pytest.mark.parametrize("sort", ["{bad", "[1]", "[null]", "5", ["[]", "[]"]])
+def test_invalid_sorts_are_rejected(sort):
+    with pytest.raises(HTTPException) as error:
+        plan = main.get_search_plan({"sort": sort})
+        main.get_sort_by(plan["sort"], plan["seed"])
+    assert error.value.status_code == 400
+
+
+def test_wildcard_without_prefix_is_not_a_filter():
+    plan = main.get_search_plan(
+        {"field_keywords": ["*", "**"], "type_keywords": "wildcard"}
+    )
+    assert plan["filters"] == []
+    plan = main.get_search_plan({"field_keywords": "Sam*", "type_keywords": "wildcard"})
+    assert plan["filters"] == ["keywords:[Sam*]"]
+
+
+def test_document_hash_follows_the_title_rank():
+    card = {"cardid": "HFW001", "content_hash": "ab" * 20, "title_rank": 3}
+    moved = {**card, "title_rank": 4}
+    assert main.document_hash(card, b"") != main.document_hash(moved, b"")
+    assert main.document_hash(card, b"") == main.document_hash(dict(card), b"")
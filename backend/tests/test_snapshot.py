@@ -0,0 +1,81 @@
+import hashlib
+import json
+
+import pytest
+
+from backend import snapshot
+from backend.snapshot import Snapshot, SnapshotWriter
+
+DOCUMENTS = [
+    {"cardid": "HFW001", "title": ["Akodo Kaneka"]},
+    {"cardid": "HFW002", "title": ["Bayushi Kachiko"], "content_hash": "ab" * 20},
+    {"cardid": "Onyx003", "title": ["Doji Hoturi"]},
+]
+
+
+def write(path, documents) -> Snapshot:
+    writer = SnapshotWriter(path, "l5r_20260101000000")
+    for document in documents:
+        writer.add(document)
+    writer.commit()
+    return Snapshot(path)
+
+
+def test_round_trip(tmp_path):
+    cards = write(tmp_path / "cards.snapshot", DOCUMENTS)
+
+    assert len(cards) == 3
+    assert sorted(cards) == ["HFW001", "HFW002", "Onyx003"]
+    assert cards.meta["version"] == "l5r_20260101000000"
+    for document in DOCUMENTS:
+        assert cards.document(document["cardid"]) == document
+
+    data, digest = cards.get("HFW001")
+    assert json.loads(data) == DOCUMENTS[0]
+    assert digest == hashlib.sha1(data).hexdigest()
+    # The hash computed by the ingestor is kept as is
+    assert cards.get("HFW002")[1] == "ab" * 20
+    cards.close()
+
+
+def test_probes_past_collisions(tmp_path, monkeypatch):
+    # Every key lands on the last slot, lookups have to wrap around the table
+    monkeypatch.setattr(snapshot, "key_hash", lambda key: 7)
+    cards = write(tmp_path / "cards.snapshot", DOCUMENTS)
+
+    assert cards.slots == 8
+    for document in DOCUMENTS:
+        assert cards.document(document["cardid"]) == document
+    assert "HFW004" not in cards
+    cards.close()
+
+
+def test_missing_key(tmp_path):
+    cards = write(tmp_path / "cards.snapshot", DOCUMENTS)
+
+    assert cards.get("HFW004") is None
+    assert cards.document("HFW004") is None
+    assert "HFW004" not in cards
+    assert "HFW001" in cards
+    cards.close()
+
+
+def test_abort_keeps_the_previous_snapshot(tmp_path):
+    path = tmp_path / "cards.snapshot"
+    write(path, DOCUMENTS[:1]).close()
+
+    writer = SnapshotWriter(path, "l5r_20260102000000")
+    writer.add(DOCUMENTS[1])
+    writer.abort()
+
+    cards = Snapshot(path)
+    assert list(cards) == ["HFW001"]
+    assert not (tmp_path / "cards.snapshot.tmp").exists()
+    cards.close()
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "cards.snapshot"
+    path.write_bytes(b"not a snapshot" * 10)
+    with pytest.raises(ValueError):
+        Snapshot(path)
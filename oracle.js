@@ -986,17 +986,17 @@ function imagehashtourl(card) {
 
 function updateselect(select) {
     // creates an array consisting of the sorted elements of that field
+  // GET, without a JSON content type, so that the browser caches the lookups
+  // and revalidates them with their ETag, without a CORS preflight
   $.ajax({
-	  type: 'POST',
+	  type: 'GET',
 	  url: apiuri+"/attributes",
 	  data: {
 	    table: database,
 	    lookup: select,
       optgroup: 1
 	  },
-	  contentType: 'application/json',
 	  dataType: 'json',
-	  responseType: 'application/json',
 	  success: function(raw) {
 	    console.log(["select lookup results: ",select,raw]);
 	    cache_select(select,raw);
@@ -1014,17 +1014,17 @@ function updateselect(select) {
 
 function updateselectmulti(one,two) {
     // creates a hash of "one" like updateselect, but values are arrays of associated "two" values  (set, rarities in that set)
+  // GET, without a JSON content type, so that the browser caches the lookups
+  // and revalidates them with their ETag, without a CORS preflight
   $.ajax({
-	  type: 'POST',
+	  type: 'GET',
 	  url: apiuri+"/attributes",
 	  data: {
 	    table: database,
 	    lookup: one+":"+two,
       optgroup: 1
 	  },
-	  contentType: 'application/json',
 	  dataType: 'json',
-	  responseType: 'application/json',
 	  success: function(raw) {
 	    console.log("multi select lookup: "+one+":"+two+" ::"+raw);
 	    cache_select(one,raw);
@@ -1137,6 +1137,10 @@ function dosearch(from=0,forcedata=false,skipload=false) {
   // Note: if from > 0, we are triggering from paging, not from searching
   datarequest['size'] = 50;
   datarequest['from'] = from;
+  // Deep pages are only served by seeking past the previous one
+  if(from > 0 && searchcache[database]['queryafter'][qs]) {
+	  datarequest['search_after'] = searchcache[database]['queryafter'][qs];
+  }
   $('#lastsearchquery').val(qs);
 
   // Cache lookup
@@ -1175,6 +1179,7 @@ function dosearch(from=0,forcedata=false,skipload=false) {
 		    dataret = raw.hits.hits.map(x=>x._source);
         //		    console.log(dataret);
 		    searchcache[database]['querytotal'][qs] = raw.hits.total;
+		    searchcache[database]['queryafter'][qs] = raw.search_after;
 		    if(dataret.length>0) {
 		      dataret = dataret.map(imagehashtourl);
 		      var html = rendercards(dataret,datarequest,qs);
@@ -1198,6 +1203,12 @@ function dosearch(from=0,forcedata=false,skipload=false) {
 	    error: function(error) {
     		console.log("Epic Fail: "+JSON.stringify(error));
 		    console.log(error);
+		    if(from > 0) {
+			    // Keep the pages already shown, and stop asking for more
+			    $(".moreloading").remove();
+			    searchcache[database]['querytotal'][qs] = searchcache[database]['querydata'][qs].length;
+			    return;
+		    }
 		    $("#resultsearch").html(searcherror['error']);
 		    // This works to force a query failure:  * 234Sdfjkl:sjdfkl23dsf $^@$%
 		    // TODO: trap to handle compile-ish failure on lambda
@@ -1858,7 +1869,7 @@ $(document).ready(function(){
   
   //TODO:  put some stuff in here into functions.   make sure order optimized.
   searchcache[database] = {
-	  'data': {},    'querydata': {},    'querytotal': {}
+	  'data': {},    'querydata': {},    'querytotal': {},    'queryafter': {}
   };
   templateactive[database] = {};
   